@@ -6,6 +6,123 @@ from pathlib import Path
 # Для Coolify используйте переменную окружения BOT_TOKEN
 BOT_TOKEN = os.getenv("BOT_TOKEN", "ВАШ_TELEGRAM_BOT_TOKEN")
 
+# Адрес Bot API: свой сервер telegram-bot-api или локальная заглушка нагрузочного теста (ev_loadtest.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
 # Базовая директория проекта
 # По умолчанию — папка, где лежит сам config.py
 BASE_DIR = Path(__file__).resolve().parent
+
+# Пул процессов для сборки презентаций
+# RENDER_WORKERS — сколько презентаций собирается параллельно
+# RENDER_QUEUE_SIZE — сколько фоновых разборов Excel может ждать свободного процесса сверх RENDER_WORKERS;
+# сборки из очереди (JOB_QUEUE_MAX) в этот лимит не упираются
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "20"))
+
+# Способ заполнения таблиц: "clone" (быстрый, по прототипам строк) или "classic"
+RENDER_MODE = os.getenv("RENDER_MODE", "clone")
+
+# Запись .pptx: "standard" (prs.save в конце) или "stream" — слайды пишутся в файл по мере сборки,
+# пиковая память не растет с числом слайдов; содержимое файла то же самое
+PPTX_WRITER = os.getenv("PPTX_WRITER", "standard")
+
+# Кеш на диске (обработанные фоны и т.п.)
+CACHE_DIR = Path(os.getenv("CACHE_DIR", str(BASE_DIR / "cache")))
+
+# Фон уменьшается до размера слайда при BG_DPI точек на дюйм и пережимается в JPEG
+BG_DPI = int(os.getenv("BG_DPI", "150"))
+BG_JPEG_QUALITY = int(os.getenv("BG_JPEG_QUALITY", "85"))
+
+# Кеш готовых презентаций: повторная отправка тех же файлов отдается сразу
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", "500"))
+RESULT_CACHE_MAX_AGE_HOURS = int(os.getenv("RESULT_CACHE_MAX_AGE_HOURS", "72"))
+
+# Хранилище скачанных из Telegram файлов: повторно присланный файл не скачивается заново
+BLOB_STORE_MAX_MB = int(os.getenv("BLOB_STORE_MAX_MB", "300"))
+
+# IN_MEMORY_JOBS=1 — файлы задачи не пишутся в work/: загрузка, сборка и отправка идут через память
+IN_MEMORY_JOBS = os.getenv("IN_MEMORY_JOBS", "0") == "1"
+
+# Уборка рабочей папки work/: папки задач старше WORK_MAX_AGE_MINUTES удаляются,
+# а при превышении WORK_MAX_MB первыми удаляются самые старые неактивные
+WORK_MAX_AGE_MINUTES = int(os.getenv("WORK_MAX_AGE_MINUTES", "60"))
+WORK_MAX_MB = int(os.getenv("WORK_MAX_MB", "1000"))
+WORK_JANITOR_INTERVAL_SECONDS = int(os.getenv("WORK_JANITOR_INTERVAL_SECONDS", "300"))
+
+# Постоянные данные бота (сессии и т.п.)
+DATA_DIR = Path(os.getenv("DATA_DIR", str(BASE_DIR / "data")))
+
+# Сессии /pp: "memory" — в памяти процесса, "sqlite" — в DATA_DIR/sessions.sqlite3 (переживают перезапуск)
+# sqlite не совмещается с IN_MEMORY_JOBS=1: в сессии лежали бы сами файлы
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_TTL_MINUTES = int(os.getenv("SESSION_TTL_MINUTES", "60"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "1000"))
+
+# Режим получения обновлений: "polling" (по умолчанию) или "webhook".
+# В режиме webhook бот сам поднимает HTTP-сервер: POST WEBHOOK_PATH для Telegram и GET /healthz.
+# WEBHOOK_URL — публичный адрес (https://bot.example.com); если не задан, вебхук у Telegram не регистрируется
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_BODY_BYTES = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", str(1024 * 1024)))
+
+# Сколько обновлений Telegram обрабатывается одновременно (разные чаты не ждут друг друга)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# Быстрая проверка Excel по оглавлению zip до разбора: лимит строк на листах 3–8
+# и объём книги после распаковки
+MAX_SHEET_ROWS = int(os.getenv("MAX_SHEET_ROWS", "20000"))
+MAX_XLSX_UNCOMPRESSED_MB = int(os.getenv("MAX_XLSX_UNCOMPRESSED_MB", "100"))
+
+# Лимиты ресурсов: размер файла проверяется до скачивания, размер картинки — по заголовку.
+# Время и память ограничиваются для каждой задачи в процессе пула (0 — без ограничения)
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "20"))
+MAX_IMAGE_MEGAPIXELS = int(os.getenv("MAX_IMAGE_MEGAPIXELS", "50"))
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", "120"))
+JOB_MAX_MEMORY_MB = int(os.getenv("JOB_MAX_MEMORY_MB", "2048"))
+
+# Сколько часов хранится разобранное меню последней презентации чата для команды /bg
+MENU_MODEL_MAX_AGE_HOURS = int(os.getenv("MENU_MODEL_MAX_AGE_HOURS", "72"))
+
+# Меню, в котором строк не меньше этого числа, собирается по листам в нескольких процессах пула
+RENDER_SPLIT_MIN_ROWS = int(os.getenv("RENDER_SPLIT_MIN_ROWS", "600"))
+
+# Кеш собранных слайдов по листам: при повторной отправке книги пересобираются только измененные листы.
+# Срок хранения — RESULT_CACHE_MAX_AGE_HOURS
+SHEET_CACHE_MAX_MB = int(os.getenv("SHEET_CACHE_MAX_MB", "200"))
+
+# Кеш обработанных фонов (уменьшенных и пережатых). Срок хранения — RESULT_CACHE_MAX_AGE_HOURS
+BG_CACHE_MAX_MB = int(os.getenv("BG_CACHE_MAX_MB", "100"))
+
+# Очередь сборок в DATA_DIR/jobs.sqlite3: сколько задач может ждать и начальная оценка длительности
+# одной сборки (по ней пользователю показывается примерное ожидание, дальше оценка уточняется)
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "200"))
+JOB_SECONDS_ESTIMATE_INITIAL = int(os.getenv("JOB_SECONDS_ESTIMATE_INITIAL", "20"))
+
+# Логи: уровень и формат ("text" — строки key=value, "json" — по объекту JSON на строку).
+# В каждой записи есть id задачи очереди (job), у замеров этапов — время и пиковая память
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# Метрики в формате Prometheus: GET /metrics на METRICS_LISTEN:METRICS_PORT (0 — выключено).
+# По умолчанию доступны только с этой машины; в Docker для сбора снаружи — METRICS_LISTEN=0.0.0.0
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Исходящие запросы к Telegram. Telegram пропускает около 30 сообщений в секунду на бота и около одного
+# в секунду в один чат (короткие всплески допустимы); сверх этого отвечает RetryAfter. Бот сам держит
+# темп ниже лимитов, а при RetryAfter и сетевых ошибках повторяет запрос до TELEGRAM_MAX_RETRIES раз
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "5"))
+
+# Пул соединений к Bot API и таймауты (секунды). Отправка готовой .pptx получает отдельный,
+# длинный таймаут: файл в десятки мегабайт не успевает уйти за обычные несколько секунд
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "20"))
+TELEGRAM_UPLOAD_TIMEOUT = float(os.getenv("TELEGRAM_UPLOAD_TIMEOUT", "300"))
@@ -0,0 +1,280 @@
+import argparse
+import io
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from config import BASE_DIR, BG_DPI, BG_JPEG_QUALITY, PPTX_WRITER, RENDER_MODE
+from ev_images import prepare_background
+from ev_metrics import collect_phases, phase
+from ev_pptx import (
+    PPTX_WRITER_STANDARD,
+    PPTX_WRITER_STREAM,
+    build_menu_model,
+    build_workbook_context,
+    merge_sheet_slides,
+    render_book,
+    render_sheet_slides,
+)
+from ev_synth import build_background, build_menu_workbook
+
+# замер сборки презентации на синтетических книгах (ev_synth) и сравнение с сохраненным baseline.
+#   python ev_bench.py                      — замерить и сравнить с bench_baseline.json (код 1 при регрессии)
+#   python ev_bench.py --update-baseline    — замерить и записать результат как новый baseline
+#   python ev_bench.py --compare            — проверить, что потоковая запись (stream) дает те же .pptx, что standard
+# Время зависит от машины: baseline записывается и сравнивается на одном и том же железе
+
+BASELINE_PATH = BASE_DIR / "bench_baseline.json"
+
+# этапы в порядке сборки; sheet — сумма по всем листам
+STAGES = ("load_workbook", "collect_rows", "background", "sheet", "save")
+
+
+class Scenario(NamedTuple):
+    dishes_per_sheet: int
+    bg_size: tuple
+    skip_columns: bool = False
+
+
+SCENARIOS = {
+    "tiny": Scenario(3, (1280, 720)),
+    "small": Scenario(40, (1920, 1080)),
+    "skip": Scenario(40, (1920, 1080), skip_columns=True),
+    "medium": Scenario(300, (3000, 2000)),
+    "large": Scenario(1500, (6000, 4000)),
+}
+
+# регрессия — результат хуже baseline больше чем на долю tolerance и больше чем на абсолютный порог
+# (короткие этапы шумят на миллисекундах)
+MIN_SECONDS_DELTA = 0.05
+MIN_MEMORY_DELTA = 16 * 1024 * 1024
+MIN_SIZE_DELTA = 1024
+
+
+def prepare_inputs(name: str, scenario: Scenario, work_dir: Path):
+    xlsx_path = work_dir / f"{name}.xlsx"
+    bg_path = work_dir / f"{name}.png"
+    xlsx_path.write_bytes(build_menu_workbook(scenario.dishes_per_sheet, seed=1, skip_columns=scenario.skip_columns))
+    bg_path.write_bytes(build_background(*scenario.bg_size, seed=1))
+    return xlsx_path, bg_path
+
+
+def run_once(xlsx_path: Path, bg_path: Path, render_mode: str, writer: str) -> dict:
+    # выполняется в отдельном процессе: пиковая память не зависит от прошлых прогонов,
+    # а фон каждый раз готовится заново во временном кеше
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        out_path = tmp / "deck.pptx"
+        started = time.perf_counter()
+        with collect_phases() as phases:
+            with phase("load_workbook"):
+                ctx = build_workbook_context(xlsx_path)
+            with phase("collect_rows"):
+                model = build_menu_model(ctx)
+            with phase("background"):
+                bg = prepare_background(bg_path, tmp, BG_DPI, BG_JPEG_QUALITY)
+            render_book(model, bg, out_path, render_mode, writer=writer)
+        total_seconds = time.perf_counter() - started
+        output_bytes = out_path.stat().st_size
+
+    stages = {}
+    for record in phases:
+        stage = stages.setdefault(record["phase"], {"seconds": 0.0, "peak_rss_bytes": 0})
+        stage["seconds"] += record["seconds"]
+        stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], record.get("peak_rss_bytes") or 0)
+    return {
+        "seconds": total_seconds,
+        "peak_rss_bytes": max(stage["peak_rss_bytes"] for stage in stages.values()),
+        "output_bytes": output_bytes,
+        "rows": sum(len(sheet.rows) for sheet in model.sheets),
+        "stages": stages,
+    }
+
+
+def summarize(runs: list) -> dict:
+    # время — лучшее из повторов (помехи только добавляют время), память — медиана;
+    # размер файла от повтора не зависит
+    result = {
+        "seconds": min(run["seconds"] for run in runs),
+        "peak_rss_bytes": statistics.median(run["peak_rss_bytes"] for run in runs),
+        "output_bytes": runs[0]["output_bytes"],
+        "rows": runs[0]["rows"],
+        "stages": {},
+    }
+    for stage in STAGES:
+        samples = [run["stages"][stage] for run in runs if stage in run["stages"]]
+        if samples:
+            result["stages"][stage] = {
+                "seconds": min(s["seconds"] for s in samples),
+                "peak_rss_bytes": statistics.median(s["peak_rss_bytes"] for s in samples),
+            }
+    return result
+
+
+def run_benchmarks(names, repeat: int, render_mode: str, writer: str) -> dict:
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        for name in names:
+            xlsx_path, bg_path = prepare_inputs(name, SCENARIOS[name], work_dir)
+            runs = []
+            for _ in range(repeat):
+                # новый процесс на каждый прогон
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                    runs.append(executor.submit(run_once, xlsx_path, bg_path, render_mode, writer).result())
+            # в ключе режим и способ записи: baseline хранит их раздельно
+            key = f"{name}/{render_mode}/{writer}"
+            results[key] = summarize(runs)
+            print_result(key, results[key])
+    return results
+
+
+def zip_differences(expected: bytes, actual: bytes) -> list:
+    # записи zip, которые есть только в одном файле или отличаются содержимым
+    with zipfile.ZipFile(io.BytesIO(expected)) as a, zipfile.ZipFile(io.BytesIO(actual)) as b:
+        names_a, names_b = set(a.namelist()), set(b.namelist())
+        differ = sorted(names_a ^ names_b)
+        differ += sorted(name for name in names_a & names_b if a.read(name) != b.read(name))
+    return differ
+
+
+def build_deck(model, bg, render_mode: str, writer: str, split: bool) -> bytes:
+    out = io.BytesIO()
+    if split:
+        # как при сборке по листам в пуле: слайды каждого листа отдельно, потом склейка
+        sheet_slides = [render_sheet_slides(model, sheet, render_mode) for sheet in model.sheets]
+        merge_sheet_slides(bg, sheet_slides, out, writer)
+    else:
+        render_book(model, bg, out, render_mode, writer=writer)
+    return out.getvalue()
+
+
+def compare_writers(names) -> int:
+    # одни и те же книги в обоих режимах, целиком и по листам: stream должен совпасть со standard побайтно
+    failures = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        for name in names:
+            xlsx_path, bg_path = prepare_inputs(name, SCENARIOS[name], work_dir)
+            model = build_menu_model(build_workbook_context(xlsx_path))
+            bg = prepare_background(bg_path, work_dir, BG_DPI, BG_JPEG_QUALITY)
+            for render_mode in ("clone", "classic"):
+                for split in (False, True):
+                    key = f"{name}/{render_mode}/{'split' if split else 'book'}"
+                    expected = build_deck(model, bg, render_mode, PPTX_WRITER_STANDARD, split)
+                    actual = build_deck(model, bg, render_mode, PPTX_WRITER_STREAM, split)
+                    differ = zip_differences(expected, actual)
+                    with zipfile.ZipFile(io.BytesIO(expected)) as z:
+                        entries = len(z.namelist())
+                    if differ:
+                        failures += 1
+                        print(f"{key}: отличаются {len(differ)} из {entries} записей: {', '.join(differ[:5])}")
+                    else:
+                        print(f"{key}: {entries} записей совпадают")
+    return failures
+
+
+def mb(value: float) -> str:
+    return f"{value / (1024 * 1024):.1f} МБ"
+
+
+def print_result(key: str, result: dict):
+    print(f"{key}: {result['rows']} строк, {result['seconds']:.3f} с, пик {mb(result['peak_rss_bytes'])}, "
+          f"файл {result['output_bytes'] / 1024:.1f} КБ")
+    for stage, values in result["stages"].items():
+        print(f"    {stage:<14} {values['seconds']:8.3f} с   пик {mb(values['peak_rss_bytes'])}")
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float, memory_tolerance: float) -> list:
+    regressions = []
+
+    def check(key, what, current, base, tol, min_delta, fmt):
+        if current > base * (1 + tol) and current - base > min_delta:
+            growth = f" (+{(current / base - 1) * 100:.0f}%)" if base else ""
+            regressions.append(f"{key} {what}: {fmt(current)} против {fmt(base)}{growth}")
+
+    def seconds(value):
+        return f"{value:.3f} с"
+
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key}: нет в baseline, не сравнивается")
+            continue
+        check(key, "время", result["seconds"], base["seconds"], tolerance, MIN_SECONDS_DELTA, seconds)
+        check(key, "пик памяти", result["peak_rss_bytes"], base["peak_rss_bytes"], memory_tolerance, MIN_MEMORY_DELTA, mb)
+        check(key, "размер файла", result["output_bytes"], base["output_bytes"], 0.02, MIN_SIZE_DELTA, str)
+        for stage, values in result["stages"].items():
+            base_stage = base["stages"].get(stage)
+            if base_stage is None:
+                continue
+            check(key, f"{stage}: время", values["seconds"], base_stage["seconds"], tolerance, MIN_SECONDS_DELTA, seconds)
+            check(key, f"{stage}: пик памяти", values["peak_rss_bytes"], base_stage["peak_rss_bytes"],
+                  memory_tolerance, MIN_MEMORY_DELTA, mb)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Замер сборки презентаций на синтетических книгах")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="через запятую: " + ", ".join(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=5, help="повторов на сценарий, время — лучшее из них")
+    parser.add_argument("--mode", default=RENDER_MODE, choices=("clone", "classic"))
+    parser.add_argument("--writer", default=PPTX_WRITER, choices=("standard", "stream"))
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="записать результат в baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимый рост времени (доля)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.15, help="допустимый рост пиковой памяти (доля)")
+    parser.add_argument("--json", type=Path, help="куда записать результаты замера")
+    parser.add_argument("--compare", action="store_true", help="сравнить записи zip у stream и standard вместо замера")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error("неизвестные сценарии: " + ", ".join(unknown))
+
+    if args.compare:
+        failures = compare_writers(names)
+        print("Отличий нет" if not failures else f"ОТЛИЧИЯ: {failures}")
+        return 1 if failures else 0
+
+    results = run_benchmarks(names, max(1, args.repeat), args.mode, args.writer)
+    if args.json:
+        args.json.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+
+    if args.update_baseline:
+        baseline.setdefault("results", {}).update(results)
+        baseline["machine"] = {"python": platform.python_version(), "platform": platform.platform()}
+        args.baseline.write_text(json.dumps(baseline, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline записан: {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"Нет baseline ({args.baseline}); запишите его: python ev_bench.py --update-baseline")
+        return 0
+
+    regressions = find_regressions(results, baseline.get("results", {}), args.tolerance, args.memory_tolerance)
+    if regressions:
+        print("РЕГРЕССИИ:")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    print("Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
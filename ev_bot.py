@@ -1,30 +1,178 @@
 from pathlib import Path
-import shutil  # ← добавили
+import asyncio
+import hmac
+import logging
+import math
+import signal
+import time
+import weakref
 
-from openpyxl import load_workbook
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
-
-from config import BOT_TOKEN, BASE_DIR
-from ev_pptx import build_presentation
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
+
+from config import (
+    BOT_TOKEN,
+    TELEGRAM_API_URL,
+    BASE_DIR,
+    RENDER_WORKERS,
+    RENDER_QUEUE_SIZE,
+    CACHE_DIR,
+    BG_DPI,
+    BG_JPEG_QUALITY,
+    RESULT_CACHE_MAX_MB,
+    RESULT_CACHE_MAX_AGE_HOURS,
+    BLOB_STORE_MAX_MB,
+    IN_MEMORY_JOBS,
+    WORK_MAX_AGE_MINUTES,
+    WORK_MAX_MB,
+    WORK_JANITOR_INTERVAL_SECONDS,
+    DATA_DIR,
+    SESSION_BACKEND,
+    SESSION_TTL_MINUTES,
+    SESSION_MAX_ENTRIES,
+    BOT_MODE,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_BODY_BYTES,
+    CONCURRENT_UPDATES,
+    MAX_SHEET_ROWS,
+    MAX_XLSX_UNCOMPRESSED_MB,
+    MAX_UPLOAD_MB,
+    MAX_IMAGE_MEGAPIXELS,
+    MENU_MODEL_MAX_AGE_HOURS,
+    JOB_QUEUE_MAX,
+    JOB_SECONDS_ESTIMATE_INITIAL,
+    LOG_LEVEL,
+    LOG_FORMAT,
+    METRICS_LISTEN,
+    METRICS_PORT,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_MAX_RETRIES,
+    TELEGRAM_POOL_SIZE,
+    TELEGRAM_TIMEOUT,
+    TELEGRAM_UPLOAD_TIMEOUT,
+)
+from ev_cache import BlobStore, MenuModelStore, ResultCache, link_or_copy
+from ev_http import HttpResponse, HttpServer
+from ev_limits import LIMIT_TRIPS, LimitExceeded, check_image_pixels, check_upload_size, record_trip
+from ev_images import content_sha256
+from ev_metrics import (
+    JOB_ID,
+    JOB_SECONDS,
+    JOBS,
+    JOBS_QUEUED,
+    JOBS_RUNNING,
+    QUEUE_WAIT_SECONDS,
+    REGISTRY,
+    RENDER_PENDING,
+    phase,
+    setup_logging,
+)
+from ev_pptx import MENU_MODEL_VERSION, RENDERER_VERSION
+from ev_queue import JobQueue
+from ev_sessions import create_session_store
+from ev_telegram import FloodControlLimiter, Throttled
+from ev_worker import (
+    BG_CACHE,
+    RenderPool,
+    RenderQueueFull,
+    extract_job,
+    render_model,
+)
+from ev_workspace import new_job_dir, remove_dir, sweep_work_dir
+from ev_xlsx import WorkbookRejected, check_workbook_manifest
 
 WORK_DIR = BASE_DIR / "work"
-WORK_DIR.mkdir(parents=True, exist_ok=True)
 
-SESSIONS = {}
+# хранилища, очередь сборок и пул создает open_state() из main(): процессы пула (spawn) заново
+# импортируют этот модуль как __mp_main__, и на уровне модуля нельзя создавать папки и открывать базы
+SESSIONS = None
+JOB_QUEUE = None
+RENDER_POOL = None
+RESULT_CACHE = None
+MENU_MODELS = None
+BLOB_STORE = None
+
+# обновления обрабатываются параллельно, поэтому изменения сессии одного чата идут под его замком;
+# замок живет, пока его кто-то держит или ждет
+CHAT_LOCKS = weakref.WeakValueDictionary()
+
+# диспетчер очереди сборок: будится, когда в очереди или в пуле что-то изменилось
+JOB_WAKEUP = asyncio.Event()
+RUNNING_JOBS = set()
+# последнее показанное пользователю место в очереди по id задачи
+QUEUE_SHOWN = {}
+# оценка длительности одной задачи в секундах, уточняется по факту
+JOB_SECONDS_ESTIMATE = [float(JOB_SECONDS_ESTIMATE_INITIAL)]
+
+# фоновый разбор Excel по папке задачи: начинается сразу после загрузки книги,
+# к приходу фона остается только собрать слайды
+PARSE_TASKS = {}
+# папки задач, которые уже забраны из сессий, но еще не записаны в очередь сборок
+SUBMITTING = set()
+# фоновые записи в хранилище файлов: ссылки держим, пока запись не закончится
+BLOB_WRITES = set()
+
+# пауза диспетчера после ошибки (например, база очереди занята)
+DISPATCHER_RETRY_SECONDS = 5
+
+BUSY_TEXT = "Сейчас собирается много презентаций. Попробуйте, пожалуйста, через пару минут: /pp"
+FAILED_TEXT = "Не получилось подготовить презентацию. Попробуйте, пожалуйста, ещё раз: /pp"
+READY_TEXT = (
+    "✨ Презентация готова!\n\n"
+    "<i>Если еще потребуется моя помощь, отправьте команду: /pp\n"
+    "Другой фон для этого же меню: /bg</i>"
+)
+
+logger = logging.getLogger(__name__)
+
+
+def chat_lock(chat_id: int) -> asyncio.Lock:
+    lock = CHAT_LOCKS.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        CHAT_LOCKS[chat_id] = lock
+    return lock
+
+
+def open_state():
+    global SESSIONS, JOB_QUEUE, RENDER_POOL, RESULT_CACHE, MENU_MODELS, BLOB_STORE
+    WORK_DIR.mkdir(parents=True, exist_ok=True)
+
+    SESSIONS = create_session_store(
+        SESSION_BACKEND,
+        DATA_DIR / "sessions.sqlite3",
+        ttl_seconds=SESSION_TTL_MINUTES * 60,
+        max_entries=SESSION_MAX_ENTRIES,
+        in_memory_jobs=IN_MEMORY_JOBS,
+    )
 
+    # очередь сборок: готовые пары файлов ждут здесь свободного процесса пула (переживает перезапуск)
+    JOB_QUEUE = JobQueue(DATA_DIR / "jobs.sqlite3")
 
-def cleanup_work_dir():
-    if not WORK_DIR.exists():
-        return
-    for item in WORK_DIR.iterdir():
-        try:
-            if item.is_dir():
-                shutil.rmtree(item)
-            else:
-                item.unlink()
-        except Exception:
-            pass
+    RENDER_POOL = RenderPool(RENDER_WORKERS, RENDER_QUEUE_SIZE)
+
+    RESULT_CACHE = ResultCache(
+        CACHE_DIR / "decks",
+        max_bytes=RESULT_CACHE_MAX_MB * 1024 * 1024,
+        max_age_seconds=RESULT_CACHE_MAX_AGE_HOURS * 3600,
+        # обработка фона тоже влияет на результат
+        version=f"{RENDERER_VERSION}-{BG_DPI}-{BG_JPEG_QUALITY}",
+    )
+
+    MENU_MODELS = MenuModelStore(
+        DATA_DIR / "menus",
+        max_age_seconds=MENU_MODEL_MAX_AGE_HOURS * 3600,
+        version=MENU_MODEL_VERSION,
+    )
+
+    BLOB_STORE = BlobStore(CACHE_DIR / "files", max_bytes=BLOB_STORE_MAX_MB * 1024 * 1024)
 
 
 def sanitize_filename(name: str) -> str:
@@ -37,14 +185,175 @@ def sanitize_filename(name: str) -> str:
     return name
 
 
+async def download_file(tg_file, local_path: Path):
+    # tg_file — Document или PhotoSize; одинаковые файлы имеют одинаковый file_unique_id
+    unique_id = tg_file.file_unique_id
+    blob_path = await asyncio.to_thread(BLOB_STORE.get, unique_id)
+    if blob_path is not None:
+        try:
+            await asyncio.to_thread(link_or_copy, blob_path, local_path)
+            return
+        except OSError:
+            # файл вытеснили между get и копированием — скачиваем заново
+            pass
+
+    file = await tg_file.get_file()
+    tmp_path = BLOB_STORE.temp_path_for(unique_id)
+    try:
+        await file.download_to_drive(tmp_path.as_posix())
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    blob_path = await asyncio.to_thread(BLOB_STORE.commit, unique_id, tmp_path)
+    await asyncio.to_thread(link_or_copy, blob_path, local_path)
+
+
+async def download_bytes(tg_file) -> bytes:
+    unique_id = tg_file.file_unique_id
+    blob_path = await asyncio.to_thread(BLOB_STORE.get, unique_id)
+    if blob_path is not None:
+        try:
+            return await asyncio.to_thread(blob_path.read_bytes)
+        except OSError:
+            # файл вытеснили между get и чтением — скачиваем заново
+            pass
+
+    file = await tg_file.get_file()
+    data = bytes(await file.download_as_bytearray())
+    # байты уже в памяти: запись на диск идет в фоне и не задерживает ответ пользователю
+    task = asyncio.create_task(store_blob(unique_id, data))
+    BLOB_WRITES.add(task)
+    task.add_done_callback(BLOB_WRITES.discard)
+    return data
+
+
+async def store_blob(unique_id: str, data: bytes):
+    try:
+        await asyncio.to_thread(BLOB_STORE.put, unique_id, data)
+    except OSError as e:
+        # без хранилища файл просто скачается еще раз в следующий раз
+        logger.warning("Не удалось сохранить файл %s в хранилище: %s", unique_id, e)
+
+
+async def fetch_upload(tg_file, session: dict, name: str):
+    # в режиме IN_MEMORY_JOBS возвращает байты файла, иначе — путь в папке задачи
+    with phase("download", file=name, size=tg_file.file_size or 0):
+        if IN_MEMORY_JOBS:
+            return await download_bytes(tg_file)
+
+        job_dir = session["job_dir"]
+        job_dir.mkdir(parents=True, exist_ok=True)
+        local_path = job_dir / name
+        await download_file(tg_file, local_path)
+        return local_path
+
+
+async def session_call(method, *args):
+    # SQLite-хранилище сессий ждет диск — такие вызовы идут в потоке, чтобы не останавливать event loop
+    if SESSIONS.blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def update_session(chat_id: int, job_dir: Path, **fields) -> bool:
+    # перечитываем сессию под замком: пока файл скачивался, чат мог прислать /pp заново
+    async with chat_lock(chat_id):
+        session = await session_call(SESSIONS.get, chat_id)
+        if not session or session["job_dir"] != job_dir:
+            return False
+        session.update(fields)
+        await session_call(SESSIONS.set, chat_id, session)
+        return True
+
+
+def start_speculative_parse(job_dir: Path, excel):
+    old = PARSE_TASKS.pop(job_dir, None)
+    if old:
+        old.cancel()
+    task = asyncio.create_task(RENDER_POOL.run(extract_job, excel, optional=True))
+    # ошибка разбора будет показана при сборке, здесь ее только забираем
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    PARSE_TASKS[job_dir] = task
+
+
+async def take_parsed_model(job_dir: Path):
+    # None — разбор не запускался или не поместился в очередь, тогда книга разбирается вместе со сборкой
+    task = PARSE_TASKS.pop(job_dir, None)
+    if task is None:
+        return None
+    # ждем через wait: отмена самого разбора (уборкой или новым Excel) не должна выглядеть
+    # как остановка бота для задачи, которая его ждет
+    try:
+        await asyncio.wait({task})
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if task.cancelled():
+        return None
+    try:
+        return task.result()
+    except RenderQueueFull:
+        return None
+
+
+def drop_stale_parse_tasks(tasks: dict, keep):
+    # tasks — снимок PARSE_TASKS до чтения сессий и очереди; задачи, начатые позже, не трогаем
+    keep = set(keep)
+    for job_dir, task in tasks.items():
+        if job_dir not in keep and PARSE_TASKS.get(job_dir) is task:
+            PARSE_TASKS.pop(job_dir).cancel()
+
+
+async def finish_session(chat_id: int, session: dict):
+    async with chat_lock(chat_id):
+        current = await session_call(SESSIONS.get, chat_id)
+        if current and current["job_dir"] == session["job_dir"]:
+            await session_call(SESSIONS.pop, chat_id)
+    task = PARSE_TASKS.pop(session["job_dir"], None)
+    if task:
+        task.cancel()
+    if not IN_MEMORY_JOBS:
+        await asyncio.to_thread(remove_dir, session["job_dir"])
+
+
+async def janitor_loop():
+    # фоновая уборка work/: брошенные сессии и превышение бюджета диска
+    while True:
+        await asyncio.sleep(WORK_JANITOR_INTERVAL_SECONDS)
+        try:
+            await session_call(SESSIONS.expire)
+            # задача переходит из сессии в SUBMITTING, а оттуда в очередь без разрывов, поэтому читаем
+            # именно в этом порядке: задача, которой нет ни в одном из трех списков, уже завершена
+            parse_tasks = dict(PARSE_TASKS)
+            active = [s["job_dir"] for s in await session_call(SESSIONS.values)]
+            submitting = list(SUBMITTING)
+            queued_dirs = await asyncio.to_thread(JOB_QUEUE.job_dirs)
+            drop_stale_parse_tasks(parse_tasks, active + submitting + queued_dirs)
+            await asyncio.to_thread(MENU_MODELS.evict)
+            await asyncio.to_thread(BG_CACHE.evict)
+            await asyncio.to_thread(
+                sweep_work_dir,
+                WORK_DIR,
+                WORK_MAX_AGE_MINUTES * 60,
+                WORK_MAX_MB * 1024 * 1024,
+                active,
+                submitting + queued_dirs,
+            )
+        except Exception:
+            logger.exception("Не удалось очистить рабочую папку")
+
+
 async def cmd_evkusa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
 
-    SESSIONS[chat_id] = {
+    session = {
         "excel": None,
         "bg": None,
         "msg_id": None,
+        "job_dir": new_job_dir(WORK_DIR, chat_id),
     }
+    async with chat_lock(chat_id):
+        await session_call(SESSIONS.set, chat_id, session)
 
     text = (
         "👋Здравствуйте!\n"
@@ -55,20 +364,61 @@ async def cmd_evkusa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     sent = await update.message.reply_text(text, parse_mode="HTML")
-    SESSIONS[chat_id]["msg_id"] = sent.message_id
+    await update_session(chat_id, session["job_dir"], msg_id=sent.message_id)
 
 
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await cmd_evkusa(update, context)
 
 
+async def cmd_bg(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # пересборка последней презентации чата с другим фоном: Excel не нужен, меню уже разобрано
+    chat_id = update.effective_chat.id
+    if not await asyncio.to_thread(MENU_MODELS.exists, chat_id):
+        await update.message.reply_text("Пока нечего пересобирать. Отправьте команду /pp, чтобы подготовить презентацию.")
+        return
+
+    session = {
+        "excel": None,
+        "bg": None,
+        "msg_id": None,
+        "job_dir": new_job_dir(WORK_DIR, chat_id),
+        "rebuild": True,
+    }
+    async with chat_lock(chat_id):
+        await session_call(SESSIONS.set, chat_id, session)
+
+    sent = await update.message.reply_text("🖼 Пришлите новое изображение фона — соберу презентацию с тем же меню.")
+    await update_session(chat_id, session["job_dir"], msg_id=sent.message_id)
+
+
+async def show_status(bot, chat_id: int, msg_id, text: str, **kwargs):
+    # итог задачи пишется в сообщение сессии (одно изменение вместо нового сообщения);
+    # если сообщения нет или его уже не изменить — отправляется новое
+    if msg_id:
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=msg_id, text=text, **kwargs)
+            return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            logger.warning("Чат %s: не удалось изменить сообщение %s: %s", chat_id, msg_id, e)
+    await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+
+
+async def reply_limit_exceeded(bot, chat_id: int, e: LimitExceeded, msg_id=None):
+    record_trip(e)
+    logger.warning("Чат %s: сработал лимит %s", chat_id, e.limit)
+    await show_status(bot, chat_id, msg_id, str(e))
+
+
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     if not message:
         return
 
     chat_id = message.chat_id
-    session = SESSIONS.get(chat_id)
+    session = await session_call(SESSIONS.get, chat_id)
     if not session:
         return
 
@@ -77,24 +427,41 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     filename = (doc.file_name or "").lower()
-    chat_dir = WORK_DIR / str(chat_id)
-    chat_dir.mkdir(parents=True, exist_ok=True)
-
-    if filename.endswith((".xlsx", ".xlsm")):
-        file = await doc.get_file()
-        local_path = chat_dir / "menu.xlsx"
-        await file.download_to_drive(local_path.as_posix())
-        session["excel"] = local_path
-    elif filename.endswith((".png", ".jpg", ".jpeg", ".bmp")):
-        file = await doc.get_file()
-        ext = Path(filename).suffix or ".png"
-        local_path = chat_dir / f"background{ext}"
-        await file.download_to_drive(local_path.as_posix())
-        session["bg"] = local_path
-    else:
+    is_excel = filename.endswith((".xlsx", ".xlsm"))
+    if not is_excel and not filename.endswith((".png", ".jpg", ".jpeg", ".bmp")):
         await message.reply_text("Я принимаю только Excel (.xlsx/.xlsm) и изображения.")
         return
 
+    try:
+        check_upload_size(doc.file_size, MAX_UPLOAD_MB * 1024 * 1024)
+        if is_excel:
+            excel = await fetch_upload(doc, session, "menu.xlsx")
+            await asyncio.to_thread(
+                check_workbook_manifest,
+                excel,
+                MAX_SHEET_ROWS,
+                MAX_XLSX_UNCOMPRESSED_MB * 1024 * 1024,
+            )
+        else:
+            ext = Path(filename).suffix or ".png"
+            bg = await fetch_upload(doc, session, f"background{ext}")
+            await asyncio.to_thread(check_image_pixels, bg, MAX_IMAGE_MEGAPIXELS * 1_000_000)
+    except LimitExceeded as e:
+        await reply_limit_exceeded(context.bot, chat_id, e)
+        return
+    except WorkbookRejected as e:
+        await message.reply_text(str(e))
+        return
+
+    if is_excel:
+        stored = await update_session(chat_id, session["job_dir"], excel=excel)
+        if stored:
+            start_speculative_parse(session["job_dir"], excel)
+    else:
+        stored = await update_session(chat_id, session["job_dir"], bg=bg)
+
+    if not stored:
+        return
     await maybe_run_generation(update, context, chat_id)
 
 
@@ -104,7 +471,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     chat_id = message.chat_id
-    session = SESSIONS.get(chat_id)
+    session = await session_call(SESSIONS.get, chat_id)
     if not session:
         return
 
@@ -112,90 +479,443 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     photo = message.photo[-1]
-    chat_dir = WORK_DIR / str(chat_id)
-    chat_dir.mkdir(parents=True, exist_ok=True)
-
-    file = await photo.get_file()
-    local_path = chat_dir / "background.jpg"
-    await file.download_to_drive(local_path.as_posix())
-    session["bg"] = local_path
+    try:
+        check_upload_size(photo.file_size, MAX_UPLOAD_MB * 1024 * 1024)
+        bg = await fetch_upload(photo, session, "background.jpg")
+        await asyncio.to_thread(check_image_pixels, bg, MAX_IMAGE_MEGAPIXELS * 1_000_000)
+    except LimitExceeded as e:
+        await reply_limit_exceeded(context.bot, chat_id, e)
+        return
+    if not await update_session(chat_id, session["job_dir"], bg=bg):
+        return
 
     await maybe_run_generation(update, context, chat_id)
 
 
 async def maybe_run_generation(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
-    session = SESSIONS.get(chat_id)
-    if not session:
-        return
+    # сессия с обоими файлами забирается под замком, поэтому в очередь попадает ровно один раз
+    async with chat_lock(chat_id):
+        session = await session_call(SESSIONS.get, chat_id)
+        if not session:
+            return
+        if not (session.get("excel") or session.get("rebuild")) or not session.get("bg"):
+            return
+        SUBMITTING.add(session["job_dir"])
+        await session_call(SESSIONS.pop, chat_id)
+
+    try:
+        await enqueue_generation(context.bot, chat_id, session)
+    finally:
+        SUBMITTING.discard(session["job_dir"])
 
-    excel_path = session.get("excel")
-    bg_path = session.get("bg")
 
-    if not excel_path or not bg_path:
+def job_dedupe_key(job: dict) -> str:
+    # одинаковые файлы — одинаковый ключ; после /bg меню берется из прошлой сборки, ключ — только по фону
+    if job["excel"] is None:
+        return "bg-" + content_sha256(job["bg"])
+    return RESULT_CACHE.key_for(job["excel"], job["bg"])
+
+
+async def enqueue_generation(bot, chat_id: int, job: dict):
+    if await asyncio.to_thread(JOB_QUEUE.queued_count) >= JOB_QUEUE_MAX:
+        JOBS.inc(result="queue_full")
+        await show_status(bot, chat_id, job.get("msg_id"), BUSY_TEXT)
+        await finish_session(chat_id, job)
         return
 
-    msg_id = session.get("msg_id")
-    if msg_id:
+    try:
+        key = await asyncio.to_thread(job_dedupe_key, job)
+    except OSError:
+        key = str(job["job_dir"])
+
+    _, is_new = await asyncio.to_thread(JOB_QUEUE.submit, chat_id, key, job)
+    if not is_new:
+        JOBS.inc(result="duplicate")
+        await show_status(
+            bot, chat_id, job.get("msg_id"), "Эти файлы уже в очереди — пришлю презентацию, как только она будет готова."
+        )
+        await finish_session(chat_id, job)
+        return
+    JOB_WAKEUP.set()
+
+
+def format_wait(seconds: float) -> str:
+    if seconds < 60:
+        return "меньше минуты"
+    return f"около {round(seconds / 60)} мин."
+
+
+async def announce_queue_positions(bot):
+    # место в очереди пишется в сообщение сессии (msg_id); сообщение меняется, только если место сдвинулось
+    for job_id, chat_id, msg_id, position in await asyncio.to_thread(JOB_QUEUE.positions):
+        if not msg_id or QUEUE_SHOWN.get(job_id) == position:
+            continue
+        wait = math.ceil(position / RENDER_POOL.workers) * JOB_SECONDS_ESTIMATE[0]
         try:
-            await context.bot.edit_message_text(
+            # необязательное изменение: если лимит сообщений чата или бота исчерпан, место покажем
+            # при следующем сдвиге очереди, а не задержим диспетчер
+            await bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=msg_id,
-                text="Идет подготовка презентации...✨",
+                text=f"⏳ Презентация в очереди, место: {position}. Ожидание: {format_wait(wait)}",
+                rate_limit_args={"optional": True},
             )
+        except Throttled:
+            continue
+        except TelegramError as e:
+            logger.warning("Чат %s: не удалось показать место в очереди: %s", chat_id, e)
+        QUEUE_SHOWN[job_id] = position
+
+
+async def run_job(bot, job_id: int, chat_id: int, job: dict, created: float):
+    # id задачи попадает во все логи и замеры этой задачи, в том числе из процессов пула
+    JOB_ID.set(str(job_id))
+    QUEUE_WAIT_SECONDS.observe(max(0.0, time.time() - created))
+    logger.info("Задача чата %s начата", chat_id)
+    started = time.monotonic()
+    try:
+        result = await run_generation(bot, chat_id, job)
+    except asyncio.CancelledError:
+        # бот останавливается: задача остается в очереди и начнется заново после перезапуска
+        raise
+    except Exception:
+        # непредвиденная ошибка вне сборки (например, кешированную презентацию вытеснили до отправки
+        # или Telegram не принял статус): пользователь все равно узнает об отказе, папка задачи убирается
+        logger.exception("Задача %s чата %s завершилась с ошибкой", job_id, chat_id)
+        result = "error"
+        try:
+            await show_status(bot, chat_id, job.get("msg_id"), FAILED_TEXT)
+        except TelegramError as e:
+            logger.warning("Чат %s: не удалось сообщить об ошибке: %s", chat_id, e)
+        try:
+            await finish_session(chat_id, job)
         except Exception:
-            pass
+            logger.exception("Не удалось убрать задачу %s чата %s", job_id, chat_id)
 
-    chat_dir = excel_path.parent
+    await asyncio.to_thread(JOB_QUEUE.finish, job_id)
+    QUEUE_SHOWN.pop(job_id, None)
+    seconds = time.monotonic() - started
+    JOBS.inc(result=result)
+    JOB_SECONDS.observe(seconds)
+    logger.info("Задача чата %s завершена: %s за %.2f с", chat_id, result, seconds)
+    # скользящее среднее длительности задачи — для оценки ожидания в очереди
+    JOB_SECONDS_ESTIMATE[0] = 0.8 * JOB_SECONDS_ESTIMATE[0] + 0.2 * seconds
 
-    try:
-        wb = load_workbook(excel_path, data_only=True)
-        sheet1 = wb.worksheets[0]
-        raw = sheet1["B3"].value
-        event_name = str(raw).strip() if raw else "Фуршет"
-    except Exception:
-        event_name = "Фуршет"
 
-    file_name_base = "КП " + sanitize_filename(event_name)
-    out_path = chat_dir / (file_name_base + ".pptx")
+def job_done(task: asyncio.Task):
+    # место в пуле освобождается только здесь, поэтому и диспетчер будим отсюда
+    RUNNING_JOBS.discard(task)
+    JOB_WAKEUP.set()
+
+
+async def dispatcher_loop(bot):
+    # берет задачи из очереди, пока есть свободные процессы пула
+    while True:
+        JOB_WAKEUP.clear()
+        try:
+            while len(RUNNING_JOBS) < RENDER_POOL.workers:
+                claimed = await asyncio.to_thread(JOB_QUEUE.claim_next)
+                if claimed is None:
+                    break
+                task = asyncio.create_task(run_job(bot, *claimed))
+                RUNNING_JOBS.add(task)
+                task.add_done_callback(job_done)
+            await announce_queue_positions(bot)
+        except Exception:
+            # без диспетчера бот принимал бы файлы, но больше ничего не собирал: пробуем снова после паузы
+            logger.exception("Ошибка диспетчера очереди сборок")
+            await asyncio.sleep(DISPATCHER_RETRY_SECONDS)
+            continue
+        await JOB_WAKEUP.wait()
+
+
+async def run_generation(bot, chat_id: int, session: dict) -> str:
+    # возвращает итог задачи для метрик: ok, cached, limit, error, no_menu, send_failed, lost
+    # сообщение сессии (приглашение или место в очереди) показывает ход задачи, а в конце удаляется
+    msg_id = session.get("msg_id")
+    if session.get("payload_lost"):
+        # IN_MEMORY_JOBS: файлы задачи жили в памяти упавшего процесса, в очереди остались только метаданные
+        await show_status(bot, chat_id, msg_id, "Файлы потерялись при перезапуске бота. Пришлите их ещё раз: /pp")
+        await finish_session(chat_id, session)
+        return "lost"
+
+    excel = session["excel"]
+    bg = session["bg"]
+    in_memory = isinstance(bg, bytes)
+
+    model = None
+    # после /bg Excel не присылают: меню берется из прошлой сборки в этом чате
+    if excel is None:
+        model = await asyncio.to_thread(MENU_MODELS.load, chat_id)
+        if model is None:
+            await show_status(
+                bot, chat_id, msg_id, "Не нашел меню прошлой презентации. Отправьте команду /pp и пришлите Excel заново."
+            )
+            await finish_session(chat_id, session)
+            return "no_menu"
+
+    cache_key = None
+    cached = None
+    if excel is not None:
+        try:
+            cache_key = await asyncio.to_thread(RESULT_CACHE.key_for, excel, bg)
+            cached = await asyncio.to_thread(RESULT_CACHE.get, cache_key)
+        except Exception:
+            logger.warning("Кеш презентаций недоступен", exc_info=True)
+
+    # готовая презентация из кеша уходит сразу, промежуточный статус ей не нужен
+    if msg_id and not cached:
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=msg_id, text="Идет подготовка презентации...✨")
+        except TelegramError as e:
+            logger.warning("Чат %s: не удалось показать статус сборки: %s", chat_id, e)
 
+    # deck — путь к готовому файлу или его байты (в режиме IN_MEMORY_JOBS)
     try:
-        build_presentation(excel_path, bg_path, out_path)
+        if cached:
+            # кеш не ждет фонового разбора Excel: меню для /bg сохраняется уже после отправки
+            deck, event_name = cached
+        else:
+            if model is None:
+                model = await take_parsed_model(session["job_dir"])
+            if model is None:
+                with phase("extract"):
+                    model = await RENDER_POOL.run(extract_job, excel)
+            # render — вся сборка в пуле вместе с ожиданием процесса; этапы внутри пишутся отдельно
+            with phase("render", sheets=len(model.sheets), rows=sum(len(sheet.rows) for sheet in model.sheets)):
+                if in_memory:
+                    event_name, deck = await render_model(RENDER_POOL, model, bg)
+                else:
+                    deck = session["job_dir"] / "presentation.pptx"
+                    event_name = await render_model(RENDER_POOL, model, bg, deck)
+    except LimitExceeded as e:
+        await reply_limit_exceeded(bot, chat_id, e, msg_id)
+        await finish_session(chat_id, session)
+        return "limit"
     except Exception:
-        await update.message.reply_text("Не получилось собрать презентацию. Проверьте файлы и попробуйте ещё раз.")
-        SESSIONS.pop(chat_id, None)
-        return
+        logger.exception("Не получилось собрать презентацию чата %s", chat_id)
+        await show_status(bot, chat_id, msg_id, "Не получилось собрать презентацию. Проверьте файлы и попробуйте ещё раз.")
+        await finish_session(chat_id, session)
+        return "error"
 
-    # удаляем сообщение "Идет подготовка презентации...✨"
-    if msg_id:
+    file_name = "КП " + sanitize_filename(event_name) + ".pptx"
+
+    if model is not None:
         try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
+            await asyncio.to_thread(MENU_MODELS.save, chat_id, model)
         except Exception:
-            pass
+            logger.exception("Не удалось сохранить меню чата %s", chat_id)
 
-    await context.bot.send_message(
+    # «Презентация готова» — подпись к файлу, а не отдельное сообщение. Большой файл получает длинный таймаут
+    # и повторы даже после таймаута: лишняя копия лучше потерянной презентации
+    send_args = dict(
         chat_id=chat_id,
-        text="✨ Презентация готова!\n\n<i>Если еще потребуется моя помощь, отправьте команду: /pp</i>",
+        filename=file_name,
+        caption=READY_TEXT,
         parse_mode="HTML",
+        read_timeout=TELEGRAM_UPLOAD_TIMEOUT,
+        write_timeout=TELEGRAM_UPLOAD_TIMEOUT,
+        rate_limit_args={"retry_timeouts": True},
     )
+    try:
+        with phase("send_document", cached=bool(cached)):
+            if isinstance(deck, bytes):
+                await bot.send_document(document=deck, **send_args)
+            else:
+                with deck.open("rb") as f:
+                    await bot.send_document(document=f, **send_args)
+    except TelegramError:
+        logger.exception("Не удалось отправить презентацию в чат %s", chat_id)
+        await show_status(bot, chat_id, msg_id, "Не получилось отправить презентацию. Попробуйте, пожалуйста, ещё раз: /pp")
+        # собранная презентация все равно пригодится: повторная отправка тех же файлов возьмет ее из кеша
+        if cache_key and not cached:
+            await cache_deck(cache_key, deck, event_name)
+        await finish_session(chat_id, session)
+        return "send_failed"
+
+    # статус больше не нужен: презентация с подписью пришла следом
+    if msg_id:
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=msg_id)
+        except TelegramError as e:
+            logger.warning("Чат %s: не удалось удалить статус: %s", chat_id, e)
 
-    with out_path.open("rb") as f:
-        await context.bot.send_document(chat_id=chat_id, document=f, filename=out_path.name)
+    # в кеш пишем уже после отправки: пользователь не ждет записи всей презентации на диск
+    if cache_key and not cached:
+        await cache_deck(cache_key, deck, event_name)
 
-    # чистим всю папку work после отправки
-    cleanup_work_dir()
+    if cached and excel is not None:
+        await remember_cached_menu(chat_id, session)
 
-    SESSIONS.pop(chat_id, None)
+    # удаляем папку этой задачи после отправки; остальное в work/ убирает janitor_loop
+    await finish_session(chat_id, session)
+    return "cached" if cached else "ok"
 
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def cache_deck(cache_key: str, deck, event_name: str):
+    try:
+        await asyncio.to_thread(RESULT_CACHE.put, cache_key, deck, event_name)
+    except Exception:
+        logger.warning("Не удалось сохранить презентацию в кеш", exc_info=True)
+
+
+async def remember_cached_menu(chat_id: int, session: dict):
+    # презентация из кеша ушла без разбора Excel; меню для /bg берем из фонового разбора или разбираем сейчас.
+    # Если не вышло, прошлое меню чата удаляется, чтобы /bg не собрал презентацию по старому Excel
+    try:
+        model = await take_parsed_model(session["job_dir"])
+        if model is None:
+            model = await RENDER_POOL.run(extract_job, session["excel"], optional=True)
+        await asyncio.to_thread(MENU_MODELS.save, chat_id, model)
+    except Exception:
+        logger.warning("Чат %s: не удалось сохранить меню презентации из кеша", chat_id, exc_info=True)
+        await asyncio.to_thread(MENU_MODELS.remove, chat_id)
+
+
+async def post_init(app: Application):
+    RENDER_POOL.start()
+    app.bot_data["janitor"] = asyncio.create_task(janitor_loop())
+    requeued = await asyncio.to_thread(JOB_QUEUE.requeue_running)
+    if requeued:
+        logger.info("В очередь возвращены прерванные задачи: %s", requeued)
+    app.bot_data["dispatcher"] = asyncio.create_task(dispatcher_loop(app.bot))
+    if METRICS_PORT:
+        server = build_metrics_server()
+        await server.start()
+        app.bot_data["metrics_server"] = server
+        logger.info("Метрики: http://%s:%s/metrics", METRICS_LISTEN, METRICS_PORT)
+
+
+async def post_shutdown(app: Application):
+    for name in ("janitor", "dispatcher"):
+        task = app.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    # прерванные задачи остаются в очереди и начнутся заново после перезапуска
+    for task in list(RUNNING_JOBS):
+        task.cancel()
+    server = app.bot_data.pop("metrics_server", None)
+    if server:
+        await server.stop()
+    RENDER_POOL.shutdown()
+    SESSIONS.close()
+    JOB_QUEUE.close()
+
+
+def build_application(webhook: bool = False) -> Application:
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        # разные чаты обрабатываются параллельно, порядок внутри чата держит chat_lock
+        .concurrent_updates(CONCURRENT_UPDATES)
+        # исходящие запросы: лимиты сообщений Telegram и повторы, пул соединений и таймауты
+        .rate_limiter(FloodControlLimiter(TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_MAX_RETRIES))
+        .connection_pool_size(TELEGRAM_POOL_SIZE)
+        .connect_timeout(TELEGRAM_TIMEOUT)
+        .read_timeout(TELEGRAM_TIMEOUT)
+        .write_timeout(TELEGRAM_TIMEOUT)
+        .pool_timeout(TELEGRAM_TIMEOUT)
+    )
+    if webhook:
+        # обновления приходят через наш HTTP-сервер, Updater для long polling не нужен
+        builder = builder.updater(None)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("pp", cmd_evkusa))
+    app.add_handler(CommandHandler("bg", cmd_bg))
     app.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
 
-    app.run_polling()
+    return app
+
+
+def build_webhook_server(app: Application) -> HttpServer:
+    server = HttpServer(WEBHOOK_LISTEN, WEBHOOK_PORT, max_body_bytes=WEBHOOK_MAX_BODY_BYTES)
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET:
+            token = request.headers.get("x-telegram-bot-api-secret-token", "")
+            if not hmac.compare_digest(token, WEBHOOK_SECRET):
+                return HttpResponse(403)
+        try:
+            update = Update.de_json(request.json(), app.bot)
+        except (ValueError, KeyError, TypeError):
+            return HttpResponse(400)
+        if update is None:
+            return HttpResponse(400)
+        await app.update_queue.put(update)
+        return HttpResponse(200)
+
+    async def handle_health(request):
+        status = 200 if app.running else 503
+        return HttpResponse.json(
+            {
+                "status": "ok" if app.running else "starting",
+                "render_pending": RENDER_POOL.pending,
+                "jobs_queued": await asyncio.to_thread(JOB_QUEUE.queued_count),
+                "limit_trips": dict(LIMIT_TRIPS),
+            },
+            status=status,
+        )
+
+    server.route("POST", WEBHOOK_PATH, handle_update)
+    server.route("GET", "/healthz", handle_health)
+    return server
+
+
+def build_metrics_server() -> HttpServer:
+    server = HttpServer(METRICS_LISTEN, METRICS_PORT)
+
+    async def handle_metrics(request):
+        # текущие размеры очередей снимаются в момент запроса
+        JOBS_QUEUED.set(await asyncio.to_thread(JOB_QUEUE.queued_count))
+        JOBS_RUNNING.set(len(RUNNING_JOBS))
+        RENDER_PENDING.set(RENDER_POOL.pending)
+        return HttpResponse(200, REGISTRY.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+
+    server.route("GET", "/metrics", handle_metrics)
+    return server
+
+
+async def run_webhook(app: Application):
+    server = build_webhook_server(app)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    await post_init(app)
+    await app.start()
+    try:
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await server.start()
+        logger.info("Webhook слушает %s:%s%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        await stop.wait()
+    finally:
+        await server.stop()
+        await app.stop()
+        await post_shutdown(app)
+        await app.shutdown()
+
+
+def main():
+    setup_logging(LOG_LEVEL, LOG_FORMAT)
+    open_state()
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(build_application(webhook=True)))
+    else:
+        build_application().run_polling()
 
 
 if __name__ == "__main__":
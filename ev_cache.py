@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from ev_images import content_sha256
+
+
+class ResultCache:
+    # готовые презентации по хешу (Excel + фон + версия рендера), с вытеснением по возрасту и размеру;
+    # возраст и порядок вытеснения считаются от последнего использования (mtime файла)
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_age_seconds: int, version: str):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.version = version
+
+    def key_for(self, excel, bg) -> str:
+        # excel и bg — пути к файлам или байты
+        h = hashlib.sha256()
+        h.update(content_sha256(excel).encode())
+        h.update(content_sha256(bg).encode())
+        h.update(self.version.encode())
+        return h.hexdigest()
+
+    def _paths(self, key: str):
+        return self.cache_dir / f"{key}.pptx", self.cache_dir / f"{key}.json"
+
+    def get(self, key: str):
+        deck_path, meta_path = self._paths(key)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            stat = deck_path.stat()
+        except (OSError, ValueError):
+            return None
+
+        if stat.st_size == 0 or time.time() - stat.st_mtime > self.max_age_seconds:
+            return None
+
+        # обновляем mtime, чтобы при нехватке места первыми уходили давно не использованные
+        try:
+            os.utime(deck_path)
+        except OSError:
+            return None
+        return deck_path, meta.get("event_name") or "Фуршет"
+
+    def put(self, key: str, deck, event_name: str) -> Path:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        deck_path, meta_path = self._paths(key)
+        tmp_deck = self.cache_dir / f".{key}.{os.getpid()}.pptx"
+        tmp_meta = self.cache_dir / f".{key}.{os.getpid()}.json"
+
+        if isinstance(deck, (bytes, bytearray)):
+            tmp_deck.write_bytes(deck)
+        else:
+            shutil.copyfile(deck, tmp_deck)
+        tmp_meta.write_text(
+            json.dumps({"event_name": event_name}, ensure_ascii=False),
+            encoding="utf-8",
+        )
+        os.replace(tmp_deck, deck_path)
+        os.replace(tmp_meta, meta_path)
+
+        self.evict()
+        return deck_path
+
+    def evict(self):
+        if not self.cache_dir.exists():
+            return
+
+        now = time.time()
+        entries = []
+        for deck_path in self.cache_dir.glob("*.pptx"):
+            if deck_path.name.startswith("."):
+                continue
+            meta_path = deck_path.with_suffix(".json")
+            try:
+                stat = deck_path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                self._remove(deck_path, meta_path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, deck_path, meta_path))
+
+        total = sum(size for _, size, _, _ in entries)
+        entries.sort()
+        for _, size, deck_path, meta_path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(deck_path, meta_path)
+            total -= size
+
+    @staticmethod
+    def _remove(deck_path: Path, meta_path: Path):
+        for path in (deck_path, meta_path):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+class SheetSlidesCache:
+    # собранные слайды отдельных листов по отпечатку листа (sheet_fingerprint): при повторной отправке
+    # книги заново собираются только измененные листы. Пишут сразу несколько процессов пула,
+    # поэтому запись атомарная, а вытеснение — как у ResultCache
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_age_seconds: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.slides"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age_seconds:
+                return None
+            with path.open("rb") as f:
+                slides = pickle.load(f)
+            os.utime(path)
+        except Exception:
+            return None
+        return slides
+
+    def put(self, key: str, slides: list):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = self.cache_dir / f".{key}.{os.getpid()}.slides"
+        try:
+            with tmp_path.open("wb") as f:
+                pickle.dump(slides, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            # без кеша лист просто соберется заново в следующий раз
+            tmp_path.unlink(missing_ok=True)
+            return
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.glob("*.slides"):
+            if path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+PARTIAL_MAX_AGE_SECONDS = 3600
+
+
+class BackgroundCache:
+    # обработанные фоны (ev_images.prepare_background); файлы пишут процессы пула,
+    # а вытесняет бот при уборке — как у SheetSlidesCache, по возрасту и размеру от последнего использования
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_age_seconds: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+    def evict(self):
+        if not self.cache_dir.exists():
+            return
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.iterdir():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.name.startswith("."):
+                # недописанные файлы от упавших процессов
+                if now - stat.st_mtime > PARTIAL_MAX_AGE_SECONDS:
+                    path.unlink(missing_ok=True)
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+class BlobStore:
+    # скачанные из Telegram файлы по file_unique_id; LRU-вытеснение при превышении бюджета диска
+
+    def __init__(self, store_dir: Path, max_bytes: int):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+
+    def path_for(self, unique_id: str) -> Path:
+        # file_unique_id состоит из [A-Za-z0-9_-], но на всякий случай не пускаем разделители пути
+        safe_id = "".join(ch for ch in unique_id if ch.isalnum() or ch in "-_")
+        return self.store_dir / safe_id
+
+    def temp_path_for(self, unique_id: str) -> Path:
+        # один и тот же файл могут одновременно прислать в нескольких чатах: у каждой загрузки свой временный файл
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        return self.store_dir / f".{self.path_for(unique_id).name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.part"
+
+    def get(self, unique_id: str):
+        path = self.path_for(unique_id)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def commit(self, unique_id: str, tmp_path: Path) -> Path:
+        path = self.path_for(unique_id)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def put(self, unique_id: str, data: bytes) -> Path:
+        # то же для файла, скачанного в память (IN_MEMORY_JOBS)
+        tmp_path = self.temp_path_for(unique_id)
+        try:
+            tmp_path.write_bytes(data)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return self.commit(unique_id, tmp_path)
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for path in self.store_dir.iterdir():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.name.startswith("."):
+                # недокачанные файлы от упавших загрузок
+                if now - stat.st_mtime > PARTIAL_MAX_AGE_SECONDS:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+class MenuModelStore:
+    # последнее разобранное меню каждого чата (MenuModel) — для пересборки с другим фоном без Excel
+
+    def __init__(self, store_dir: Path, max_age_seconds: int, version: str):
+        self.store_dir = store_dir
+        self.max_age_seconds = max_age_seconds
+        self.version = version
+
+    def path_for(self, chat_id: int) -> Path:
+        return self.store_dir / f"{int(chat_id)}.pickle"
+
+    def save(self, chat_id: int, model) -> Path:
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(chat_id)
+        tmp_path = self.store_dir / f".{path.name}.{os.getpid()}"
+        with tmp_path.open("wb") as f:
+            pickle.dump((self.version, model), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return path
+
+    def load(self, chat_id: int):
+        path = self.path_for(chat_id)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age_seconds:
+                return None
+            with path.open("rb") as f:
+                version, model = pickle.load(f)
+        except Exception:
+            # нет файла, он битый или сохранен кодом, которого уже нет
+            return None
+        if version != self.version:
+            return None
+        return model
+
+    def exists(self, chat_id: int) -> bool:
+        return self.load(chat_id) is not None
+
+    def remove(self, chat_id: int) -> None:
+        self.path_for(chat_id).unlink(missing_ok=True)
+
+    def evict(self):
+        if not self.store_dir.exists():
+            return
+        now = time.time()
+        for path in self.store_dir.iterdir():
+            try:
+                if now - path.stat().st_mtime > self.max_age_seconds:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+def link_or_copy(src: Path, dest: Path):
+    # жесткая ссылка: файл в рабочей папке переживет вытеснение из хранилища
+    try:
+        dest.unlink()
+    except OSError:
+        pass
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
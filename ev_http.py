@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HttpRequest:
+    def __init__(self, method: str, path: str, headers: dict, body: bytes):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8"))
+
+
+class HttpResponse:
+    def __init__(self, status: int = 200, body: bytes = b"", content_type: str = "text/plain; charset=utf-8"):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+    @classmethod
+    def json(cls, data, status: int = 200):
+        return cls(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+
+class HttpServer:
+    # минимальный HTTP/1.1 сервер на asyncio: одно соединение — один запрос.
+    # Рассчитан на работу за reverse proxy, без внешних зависимостей
+
+    def __init__(self, host: str, port: int, max_body_bytes: int = 1024 * 1024, read_timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        self.read_timeout = read_timeout
+        self._routes = {}
+        self._server = None
+
+    def route(self, method: str, path: str, handler):
+        # handler: async (HttpRequest) -> HttpResponse
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise ValueError("bad request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > self.max_body_bytes:
+            raise OverflowError()
+        body = await reader.readexactly(length) if length else b""
+        path = target.split("?", 1)[0]
+        return HttpRequest(method.upper(), path, headers, body)
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+            except asyncio.TimeoutError:
+                response = HttpResponse(408)
+            except OverflowError:
+                response = HttpResponse(413)
+            except (ValueError, asyncio.IncompleteReadError):
+                response = HttpResponse(400)
+            else:
+                if request is None:
+                    return
+                response = await self._dispatch(request)
+
+            await self._write(writer, response)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _dispatch(self, request: HttpRequest) -> HttpResponse:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return HttpResponse(405)
+            return HttpResponse(404)
+        try:
+            return await handler(request)
+        except Exception:
+            return HttpResponse(500)
+
+    @staticmethod
+    async def _write(writer, response: HttpResponse):
+        head = (
+            f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            "Connection: close\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + response.body)
+        try:
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
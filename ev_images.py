@@ -0,0 +1,92 @@
+import hashlib
+import io
+import os
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+# размер слайда стандартного шаблона python-pptx (10 x 7.5 дюйма, 4:3)
+SLIDE_WIDTH_IN = 10.0
+SLIDE_HEIGHT_IN = 7.5
+
+# версия обработки входит в ключ кеша: при изменении алгоритма старые файлы не используются
+PREPROCESS_VERSION = 1
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_sha256(src) -> str:
+    # src — путь к файлу или уже загруженные в память байты
+    if isinstance(src, (bytes, bytearray)):
+        return hashlib.sha256(src).hexdigest()
+    return file_sha256(src)
+
+
+def open_source(src):
+    if isinstance(src, (bytes, bytearray)):
+        return io.BytesIO(src)
+    return src
+
+
+def slide_size_px(dpi: int):
+    return round(SLIDE_WIDTH_IN * dpi), round(SLIDE_HEIGHT_IN * dpi)
+
+
+def has_alpha(img: Image.Image) -> bool:
+    if img.mode in ("RGBA", "LA"):
+        return img.getextrema()[-1][0] < 255
+    return img.mode == "P" and "transparency" in img.info
+
+
+def prepare_background(src, cache_dir: Path, dpi: int, jpeg_quality: int):
+    # уменьшает фон до размера слайда и пережимает; результат кешируется по хешу содержимого
+    # (вытесняет ev_cache.BackgroundCache). Возвращает путь к обработанному файлу, а если обработать не удалось — исходный src
+    target_w, target_h = slide_size_px(dpi)
+    key = f"{content_sha256(src)}-{target_w}x{target_h}-q{jpeg_quality}-v{PREPROCESS_VERSION}"
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for ext in (".jpg", ".png"):
+        cached = cache_dir / (key + ext)
+        try:
+            # mtime — время последнего использования: при нехватке места первыми уходят давно не нужные фоны
+            os.utime(cached)
+        except OSError:
+            continue
+        return cached
+
+    try:
+        with Image.open(open_source(src)) as img:
+            # фото с телефона хранят поворот в EXIF
+            img = ImageOps.exif_transpose(img)
+            keep_alpha = has_alpha(img)
+            img = img.convert("RGBA" if keep_alpha else "RGB")
+
+            # фон растягивается на весь слайд, поэтому каждую сторону достаточно ужать до размера слайда
+            new_size = (min(img.width, target_w), min(img.height, target_h))
+            if new_size != img.size:
+                img = img.resize(new_size, Image.LANCZOS)
+    except Exception:
+        # если картинку не удалось открыть, используем исходный файл как есть
+        return src
+
+    ext = ".png" if keep_alpha else ".jpg"
+    out_path = cache_dir / (key + ext)
+    tmp_path = cache_dir / f".{key}.{os.getpid()}{ext}"
+    try:
+        if keep_alpha:
+            img.save(tmp_path, "PNG", optimize=True)
+        else:
+            img.save(tmp_path, "JPEG", quality=jpeg_quality, optimize=True, progressive=True)
+        # rename атомарный, параллельные процессы не увидят недописанный файл
+        os.replace(tmp_path, out_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        return src
+
+    return out_path
@@ -0,0 +1,111 @@
+import signal
+from collections import Counter
+from contextlib import contextmanager
+
+from PIL import Image
+
+from ev_images import open_source
+from ev_metrics import LIMIT_TRIPS_TOTAL
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# имена лимитов — ключи в LIMIT_TRIPS
+LIMIT_UPLOAD_SIZE = "upload_size"
+LIMIT_WORKBOOK_SIZE = "workbook_uncompressed"
+LIMIT_SHEET_ROWS = "sheet_rows"
+LIMIT_IMAGE_PIXELS = "image_pixels"
+LIMIT_JOB_TIME = "job_time"
+LIMIT_JOB_MEMORY = "job_memory"
+
+# сколько раз сработал каждый лимит с запуска бота (считается в основном процессе)
+LIMIT_TRIPS = Counter()
+
+
+class LimitExceeded(Exception):
+    # limit — имя лимита, message — текст для пользователя.
+    # Оба значения в args, чтобы исключение пережило передачу из процесса пула
+    def __init__(self, limit: str, message: str):
+        super().__init__(limit, message)
+        self.limit = limit
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def record_trip(e: LimitExceeded) -> None:
+    LIMIT_TRIPS[e.limit] += 1
+    LIMIT_TRIPS_TOTAL.inc(limit=e.limit)
+
+
+def check_upload_size(file_size, max_bytes: int) -> None:
+    # file_size приходит от Telegram вместе с сообщением, до скачивания; может отсутствовать
+    if file_size and file_size > max_bytes:
+        raise LimitExceeded(
+            LIMIT_UPLOAD_SIZE,
+            f"Файл слишком большой: {file_size / (1024 * 1024):.1f} МБ "
+            f"(максимум {max_bytes // (1024 * 1024)} МБ).",
+        )
+
+
+def check_image_pixels(src, max_pixels: int) -> None:
+    # Image.open читает только заголовок, пиксели не распаковываются
+    try:
+        with Image.open(open_source(src)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        # Pillow сам отказывается открывать картинки больше чем в 2 раза сверх Image.MAX_IMAGE_PIXELS —
+        # это заведомо больше нашего лимита, размер в сообщении не нужен
+        raise LimitExceeded(LIMIT_IMAGE_PIXELS, _too_many_pixels_text("", max_pixels)) from None
+    except Exception:
+        # нераспознанные картинки обрабатываются дальше как раньше
+        return
+    if width * height > max_pixels:
+        raise LimitExceeded(LIMIT_IMAGE_PIXELS, _too_many_pixels_text(f": {width}×{height}", max_pixels))
+
+
+def _too_many_pixels_text(size: str, max_pixels: int) -> str:
+    return (
+        f"Картинка для фона слишком большая{size} "
+        f"(максимум {max_pixels / 1_000_000:g} млн пикселей). Уменьшите её и пришлите ещё раз."
+    )
+
+
+def limit_process_memory(max_bytes: int) -> None:
+    # ограничивает адресное пространство текущего процесса; при превышении будет MemoryError
+    if resource is None or max_bytes <= 0:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+
+@contextmanager
+def job_limits(max_seconds: float):
+    # время задачи ограничивается SIGALRM — только в главном потоке процесса пула
+    def on_alarm(signum, frame):
+        raise LimitExceeded(
+            LIMIT_JOB_TIME,
+            f"Презентация собиралась дольше {max_seconds:g} с и была остановлена. "
+            "Проверьте, нет ли в книге лишних строк.",
+        )
+
+    use_alarm = max_seconds > 0 and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, max_seconds)
+    try:
+        yield
+    except MemoryError:
+        raise LimitExceeded(
+            LIMIT_JOB_MEMORY,
+            "Для этой книги не хватило памяти. Проверьте, нет ли в ней лишних строк и тяжелых картинок.",
+        ) from None
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
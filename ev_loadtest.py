@@ -0,0 +1,551 @@
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import math
+import os
+import secrets
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from urllib.parse import parse_qsl, quote
+
+import httpx
+
+from config import BASE_DIR
+from ev_http import HttpResponse, HttpServer
+from ev_synth import build_background, build_menu_workbook
+from ev_telegram import TokenBucket
+
+# нагрузочный тест: настоящий ev_bot.py в отдельном процессе разговаривает с локальной заглушкой Bot API,
+# а N чатов одновременно проходят /pp → Excel → фон и ждут презентацию.
+#   python ev_loadtest.py --chats 20
+#   python ev_loadtest.py --chats 50 --mode webhook --ramp 10
+# Настройки бота (RENDER_WORKERS, IN_MEMORY_JOBS и т.п.) берутся из окружения, как при обычном запуске
+
+TOKEN = "123456:LOADTEST"
+
+# сообщения и статусы бота, которые не означают ошибку
+OK_TEXTS = ("👋Здравствуйте", "✨ Презентация готова", "⏳ Презентация в очереди", "Идет подготовка")
+# лимиты Telegram для --flood: сообщений в секунду на чат и на бота (и всплеск подряд)
+FLOOD_CHAT_LIMIT = (1, 5)
+FLOOD_GLOBAL_LIMIT = (30, 30)
+CHAT_METHODS = ("sendMessage", "editMessageText", "deleteMessage", "sendDocument")
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def decode_value(value: str):
+    # python-telegram-bot шлет строки как есть, остальное — JSON
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def parse_params(request):
+    # (параметры, файлы {имя поля: (имя файла, байты)})
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        head = f"Content-Type: {content_type}\r\n\r\n".encode("latin-1")
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(head + request.body)
+        params, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            filename = part.get_filename()
+            if filename is not None:
+                files[name] = (filename, payload)
+            else:
+                params[name] = decode_value(payload.decode("utf-8"))
+        return params, files
+    if content_type.startswith("application/json"):
+        return request.json(), {}
+    body = request.body.decode("utf-8")
+    return {key: decode_value(value) for key, value in parse_qsl(body, keep_blank_values=True)}, {}
+
+
+class FakeBotApi:
+    # заглушка Bot API: ровно те методы, которыми пользуется бот, и раздача загруженных файлов.
+    # Ответы бота складываются в очередь событий своего чата
+
+    def __init__(self, host: str, port: int, token: str = TOKEN, flood: bool = False):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.server = HttpServer(host, port, max_body_bytes=512 * 1024 * 1024, read_timeout=120)
+        self.calls = Counter()
+        # flood — отвечать 429 с retry_after, как Telegram при превышении лимитов сообщений
+        self.flood = flood
+        self.flood_errors = Counter()
+        self._flood_global = TokenBucket(*FLOOD_GLOBAL_LIMIT)
+        self._flood_chats = defaultdict(lambda: TokenBucket(*FLOOD_CHAT_LIMIT))
+        self.uploaded_bytes = 0
+        self.polling_started = asyncio.Event()
+        self.webhook = None  # (url, secret) — обновления отправляются боту POST-запросом
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+        self._message_ids = defaultdict(lambda: itertools.count(1))
+        self._file_ids = itertools.count(1)
+        self._events = defaultdict(asyncio.Queue)
+        self._client = None
+        self._closing = False
+
+        for method, handler in {
+            "getMe": self.get_me,
+            "deleteWebhook": self.delete_webhook,
+            "setWebhook": self.set_webhook,
+            "getUpdates": self.get_updates,
+            "getFile": self.get_file,
+            "sendMessage": self.send_message,
+            "editMessageText": self.edit_message_text,
+            "deleteMessage": self.delete_message,
+            "sendDocument": self.send_document,
+        }.items():
+            self.server.route("POST", f"/bot{token}/{method}", self._counted(method, handler))
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=30)
+        await self.server.start()
+
+    async def stop(self):
+        # отпускаем висящие long polling запросы, иначе сервер ждал бы их до конца таймаута
+        self._closing = True
+        self._new_update.set()
+        await self.server.stop()
+        if self._client is not None:
+            await self._client.aclose()
+
+    def _counted(self, method, handler):
+        async def handle(request):
+            self.calls[method] += 1
+            params, files = parse_params(request)
+            if self.flood and method in CHAT_METHODS:
+                chat_ok = self._flood_chats[params.get("chat_id")].try_acquire()
+                if not chat_ok or not self._flood_global.try_acquire():
+                    self.flood_errors[method] += 1
+                    retry_after = 1
+                    return HttpResponse.json(
+                        {
+                            "ok": False,
+                            "error_code": 429,
+                            "description": f"Too Many Requests: retry after {retry_after}",
+                            "parameters": {"retry_after": retry_after},
+                        },
+                        status=429,
+                    )
+            return HttpResponse.json({"ok": True, "result": await handler(params, files)})
+
+        return handle
+
+    # --- сторона пользователя ---
+
+    def events(self, chat_id: int) -> asyncio.Queue:
+        return self._events[chat_id]
+
+    def add_file(self, data: bytes, unique_id: str, prefix: str = "documents") -> dict:
+        file_id = f"file{next(self._file_ids)}"
+        file_path = f"{prefix}/{file_id}"
+
+        async def download(request):
+            self.calls["download"] += 1
+            return HttpResponse(200, data, "application/octet-stream")
+
+        # python-telegram-bot экранирует ":" токена в адресе файла, HttpServer путь не раскодирует
+        for token in {self.token, quote(self.token, safe="")}:
+            self.server.route("GET", f"/file/bot{token}/{file_path}", download)
+        return {"file_id": file_id, "file_unique_id": unique_id, "file_size": len(data), "file_path": file_path}
+
+    async def push_message(self, chat_id: int, **fields):
+        message = {
+            "message_id": next(self._message_ids[chat_id]),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"Load {chat_id}"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"Load {chat_id}"},
+            **fields,
+        }
+        update = {"update_id": next(self._update_ids), "message": message}
+        if self.webhook is not None:
+            url, secret = self.webhook
+            response = await self._client.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+            response.raise_for_status()
+            return
+        self._updates.append(update)
+        self._new_update.set()
+
+    async def send_command(self, chat_id: int, command: str):
+        await self.push_message(
+            chat_id,
+            text=command,
+            entities=[{"type": "bot_command", "offset": 0, "length": len(command)}],
+        )
+
+    async def upload_document(self, chat_id: int, file: dict, file_name: str, mime_type: str):
+        document = {key: file[key] for key in ("file_id", "file_unique_id", "file_size")}
+        await self.push_message(chat_id, document={**document, "file_name": file_name, "mime_type": mime_type})
+
+    # --- методы Bot API ---
+
+    def _message(self, chat_id, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids[chat_id]),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "LoadTest"},
+            **fields,
+        }
+
+    async def get_me(self, params, files):
+        return {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+    async def delete_webhook(self, params, files):
+        return True
+
+    async def set_webhook(self, params, files):
+        return True
+
+    async def get_updates(self, params, files):
+        self.polling_started.set()
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        deadline = time.monotonic() + timeout
+        while not self._updates and not self._closing and time.monotonic() < deadline:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+        return self._updates[:limit]
+
+    async def get_file(self, params, files):
+        # файлы регистрируются в add_file под своими file_id
+        file_id = str(params["file_id"])
+        return {"file_id": file_id, "file_unique_id": file_id, "file_path": f"documents/{file_id}"}
+
+    async def send_message(self, params, files):
+        chat_id = int(params["chat_id"])
+        text = str(params.get("text", ""))
+        self._events[chat_id].put_nowait(("sendMessage", text, time.monotonic()))
+        return self._message(chat_id, text=text)
+
+    async def edit_message_text(self, params, files):
+        chat_id = int(params["chat_id"])
+        text = str(params.get("text", ""))
+        self._events[chat_id].put_nowait(("editMessageText", text, time.monotonic()))
+        return self._message(chat_id, text=text)
+
+    async def delete_message(self, params, files):
+        return True
+
+    async def send_document(self, params, files):
+        chat_id = int(params["chat_id"])
+        file_name, data = files.get("document", ("", b""))
+        self.uploaded_bytes += len(data)
+        self._events[chat_id].put_nowait(("sendDocument", file_name, time.monotonic()))
+        document = {"file_id": f"deck{chat_id}", "file_unique_id": f"deck{chat_id}", "file_name": file_name, "file_size": len(data)}
+        return self._message(chat_id, document=document)
+
+
+# --- бот ---
+
+
+async def start_bot(api: FakeBotApi, mode: str, work_dir: Path, log_file):
+    # ev_bot.py как при обычном запуске, но с Bot API на заглушке и данными во временной папке.
+    # Возвращает (процесс, адрес webhook или None)
+    env = dict(
+        os.environ,
+        BOT_TOKEN=api.token,
+        TELEGRAM_API_URL=api.url,
+        BOT_MODE=mode,
+        DATA_DIR=str(work_dir / "data"),
+        CACHE_DIR=str(work_dir / "cache"),
+    )
+    # метрики бота не нужны тесту и не должны занять порт рабочего бота
+    env.setdefault("METRICS_PORT", "0")
+    webhook = None
+    if mode == "webhook":
+        port = free_port()
+        secret = secrets.token_hex(16)
+        env.update(
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=str(port),
+            WEBHOOK_PATH="/telegram",
+            WEBHOOK_URL=f"http://127.0.0.1:{port}",
+            WEBHOOK_SECRET=secret,
+        )
+        webhook = (f"http://127.0.0.1:{port}", secret)
+
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, str(BASE_DIR / "ev_bot.py"),
+        cwd=str(BASE_DIR), env=env, stdout=log_file, stderr=asyncio.subprocess.STDOUT,
+    )
+    return proc, webhook
+
+
+async def wait_ready(api: FakeBotApi, proc, webhook, timeout: float) -> bool:
+    # polling — бот пришел за обновлениями; webhook — /healthz отвечает 200
+    async def ready():
+        if webhook is None:
+            await api.polling_started.wait()
+            return
+        async with httpx.AsyncClient(timeout=5) as client:
+            while True:
+                try:
+                    response = await client.get(webhook[0] + "/healthz")
+                    if response.status_code == 200:
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.2)
+
+    ready_task = asyncio.create_task(ready())
+    exit_task = asyncio.create_task(proc.wait())
+    done, _ = await asyncio.wait({ready_task, exit_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    ready_task.cancel()
+    exit_task.cancel()
+    if ready_task in done and webhook is not None:
+        api.webhook = (webhook[0] + "/telegram", webhook[1])
+    return ready_task in done
+
+
+async def stop_bot(proc, timeout: float = 30):
+    if proc.returncode is not None:
+        return
+    if sys.platform == "win32":
+        proc.terminate()
+    else:
+        proc.send_signal(signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+
+# --- чаты ---
+
+
+async def next_event(events: asyncio.Queue, deadline: float):
+    return await asyncio.wait_for(events.get(), max(0.0, deadline - time.monotonic()))
+
+
+def error_reason(text: str) -> str:
+    line = text.strip().splitlines()[0] if text.strip() else "пустое сообщение"
+    return line[:80]
+
+
+async def run_chat(api: FakeBotApi, chat_id: int, xlsx: dict, bg: dict, timeout: float) -> dict:
+    # /pp → Excel → фон; время до презентации отсчитывается от отправки фона —
+    # с этого момента пользователь ждет результат
+    events = api.events(chat_id)
+    deadline = time.monotonic() + timeout
+    try:
+        await api.send_command(chat_id, "/pp")
+        kind, text, _ = await next_event(events, deadline)
+        if kind != "sendMessage" or not text.startswith(OK_TEXTS[0]):
+            return {"chat": chat_id, "seconds": None, "error": error_reason(text)}
+        await api.upload_document(chat_id, xlsx, "menu.xlsx", XLSX_MIME)
+        started = time.monotonic()
+        await api.upload_document(chat_id, bg, "background.png", "image/png")
+        while True:
+            kind, text, at = await next_event(events, deadline)
+            if kind == "sendDocument":
+                return {"chat": chat_id, "seconds": at - started, "error": None}
+            # ошибки бот пишет в статус сессии или, если его не изменить, новым сообщением
+            if kind in ("sendMessage", "editMessageText") and not text.startswith(OK_TEXTS):
+                return {"chat": chat_id, "seconds": None, "error": error_reason(text)}
+    except asyncio.TimeoutError:
+        return {"chat": chat_id, "seconds": None, "error": "таймаут"}
+    except httpx.HTTPError as e:
+        return {"chat": chat_id, "seconds": None, "error": f"webhook: {type(e).__name__}"}
+
+
+async def run_rounds(api: FakeBotApi, chat_id: int, inputs: list, delay: float, timeout: float) -> list:
+    # раунды одного чата идут друг за другом, как у менеджера, который собирает несколько КП подряд
+    await asyncio.sleep(delay)
+    results = []
+    for xlsx, bg in inputs:
+        result = await run_chat(api, chat_id, xlsx, bg, timeout)
+        results.append(result)
+        if result["error"]:
+            # остальные ответы этого раунда могут прийти позже и перепутаться со следующим
+            break
+    return results
+
+
+def build_inputs(chats: int, rounds: int, dishes: int, bg_size: tuple, shared: bool) -> dict:
+    # {(чат, раунд): (байты xlsx, байты фона)}; у каждой пары свой seed, чтобы не срабатывал кеш презентаций
+    inputs = {}
+    shared_pair = None
+    for chat in range(chats):
+        for round_no in range(rounds):
+            if shared:
+                if shared_pair is None:
+                    shared_pair = (build_menu_workbook(dishes, seed=0), build_background(*bg_size, seed=0))
+                inputs[chat, round_no] = shared_pair
+                continue
+            seed = chat * 1000 + round_no + 1
+            inputs[chat, round_no] = (build_menu_workbook(dishes, seed=seed), build_background(*bg_size, seed=seed))
+    return inputs
+
+
+# --- отчет ---
+
+
+def percentile(values: list, p: float) -> float:
+    # ближайший ранг: p99 из 20 значений — максимум, а не интерполяция
+    ordered = sorted(values)
+    index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(results: list, wall_seconds: float, calls: Counter, flood_errors: Counter, uploaded_bytes: int) -> dict:
+    times = [r["seconds"] for r in results if r["error"] is None]
+    errors = Counter(r["error"] for r in results if r["error"] is not None)
+    summary = {
+        "attempts": len(results),
+        "decks": len(times),
+        "errors": sum(errors.values()),
+        "error_rate": sum(errors.values()) / len(results) if results else 0.0,
+        "error_reasons": dict(errors.most_common()),
+        "wall_seconds": wall_seconds,
+        "decks_per_minute": len(times) / wall_seconds * 60 if wall_seconds else 0.0,
+        "time_to_deck": {},
+        "api_calls": dict(sorted(calls.items())),
+        "api_calls_per_deck": sum(calls.values()) / len(times) if times else None,
+        "flood_errors": dict(sorted(flood_errors.items())),
+        "uploaded_bytes": uploaded_bytes,
+    }
+    if times:
+        summary["time_to_deck"] = {
+            "min": min(times),
+            "p50": percentile(times, 50),
+            "p95": percentile(times, 95),
+            "p99": percentile(times, 99),
+            "max": max(times),
+            "mean": statistics.fmean(times),
+        }
+    return summary
+
+
+def print_summary(summary: dict, args):
+    print(f"Чатов: {args.chats}, раундов: {args.rounds}, режим: {args.mode}" + (", лимиты Telegram" if args.flood else ""))
+    print(f"Презентаций: {summary['decks']} из {summary['attempts']}, "
+          f"ошибок: {summary['errors']} ({summary['error_rate'] * 100:.1f}%)")
+    for reason, count in summary["error_reasons"].items():
+        print(f"    {count:4} × {reason}")
+    print(f"Время теста: {summary['wall_seconds']:.1f} с, пропускная способность: {summary['decks_per_minute']:.1f} презентаций/мин")
+    if summary["time_to_deck"]:
+        t = summary["time_to_deck"]
+        print(f"Время до презентации: p50 {t['p50']:.2f} с, p95 {t['p95']:.2f} с, p99 {t['p99']:.2f} с, "
+              f"макс {t['max']:.2f} с, среднее {t['mean']:.2f} с")
+    print("Вызовы Bot API: " + ", ".join(f"{method} {count}" for method, count in summary["api_calls"].items()))
+    if summary["flood_errors"]:
+        print("Ответы 429 (flood control): " + ", ".join(f"{m} {c}" for m, c in summary["flood_errors"].items()))
+    if summary["api_calls_per_deck"] is not None:
+        print(f"    на презентацию: {summary['api_calls_per_deck']:.1f}, "
+              f"отправлено {summary['uploaded_bytes'] / (1024 * 1024):.1f} МБ")
+
+
+def print_log_tail(log_path: Path, lines: int = 30):
+    text = log_path.read_text(encoding="utf-8", errors="replace").splitlines()
+    print(f"--- последние строки лога бота ({log_path}) ---")
+    for line in text[-lines:]:
+        print(line)
+
+
+async def run(args) -> int:
+    bg_size = tuple(int(v) for v in args.bg_size.lower().split("x"))
+    print(f"Готовлю файлы: {args.chats * args.rounds} пар, {args.dishes} блюд на лист, фон {bg_size[0]}x{bg_size[1]}")
+    inputs = await asyncio.to_thread(build_inputs, args.chats, args.rounds, args.dishes, bg_size, args.shared_files)
+
+    api = FakeBotApi("127.0.0.1", free_port(), flood=args.flood)
+    await api.start()
+    with tempfile.TemporaryDirectory(prefix="ev_loadtest_") as tmp:
+        tmp = Path(tmp)
+        log_path = args.bot_log or tmp / "bot.log"
+        with open(log_path, "wb") as log_file:
+            proc, webhook = await start_bot(api, args.mode, tmp, log_file)
+            try:
+                if not await wait_ready(api, proc, webhook, args.start_timeout):
+                    print("Бот не запустился")
+                    print_log_tail(log_path)
+                    return 2
+
+                # файлы регистрируются на заглушке; одинаковые байты — один file_id
+                files = {}
+                chat_inputs = defaultdict(list)
+                for (chat, round_no), (xlsx, bg) in sorted(inputs.items()):
+                    pair = []
+                    for data, suffix in ((xlsx, "xlsx"), (bg, "png")):
+                        if id(data) not in files:
+                            files[id(data)] = api.add_file(data, f"{suffix}{len(files)}")
+                        pair.append(files[id(data)])
+                    chat_inputs[chat].append(tuple(pair))
+
+                print(f"Бот запущен ({args.mode}), {args.chats} чатов начинают за {args.ramp:g} с")
+                started = time.monotonic()
+                base_chat = 100000
+                tasks = [
+                    run_rounds(api, base_chat + chat, chat_inputs[chat],
+                               args.ramp * chat / max(1, args.chats - 1) if args.chats > 1 else 0.0, args.timeout)
+                    for chat in range(args.chats)
+                ]
+                results = [r for chat_results in await asyncio.gather(*tasks) for r in chat_results]
+                wall_seconds = time.monotonic() - started
+            finally:
+                await stop_bot(proc)
+                await api.stop()
+
+        summary = summarize(results, wall_seconds, api.calls, api.flood_errors, api.uploaded_bytes)
+        print_summary(summary, args)
+        if summary["errors"]:
+            print_log_tail(log_path)
+    if args.json:
+        args.json.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 1 if summary["errors"] else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на заглушке Bot API")
+    parser.add_argument("--chats", type=int, default=10, help="сколько чатов работают одновременно")
+    parser.add_argument("--rounds", type=int, default=1, help="сколько презентаций подряд собирает каждый чат")
+    parser.add_argument("--ramp", type=float, default=0.0, help="за сколько секунд подключаются все чаты")
+    parser.add_argument("--dishes", type=int, default=40, help="блюд на лист меню")
+    parser.add_argument("--bg-size", default="1920x1080", help="размер фона, ШxВ")
+    parser.add_argument("--shared-files", action="store_true",
+                        help="одни и те же файлы во всех чатах (после первой сборки работает кеш презентаций)")
+    parser.add_argument("--mode", default="polling", choices=("polling", "webhook"))
+    parser.add_argument("--flood", action="store_true",
+                        help="отвечать 429 с retry_after при превышении лимитов сообщений, как Telegram")
+    parser.add_argument("--timeout", type=float, default=300, help="сколько ждать одну презентацию, с")
+    parser.add_argument("--start-timeout", type=float, default=60, help="сколько ждать запуска бота, с")
+    parser.add_argument("--bot-log", type=Path, help="куда писать лог бота (по умолчанию — во временную папку)")
+    parser.add_argument("--json", type=Path, help="куда записать итоги")
+    args = parser.parse_args(argv)
+    if args.chats < 1 or args.rounds < 1:
+        parser.error("--chats и --rounds должны быть не меньше 1")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+import bisect
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# id задачи очереди для логов и замеров; asyncio копирует значение во все задачи, запущенные из run_job
+JOB_ID = contextvars.ContextVar("job_id", default="-")
+
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(mb * 1024 * 1024 for mb in (64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096))
+
+
+def _label_text(label_names, values) -> str:
+    if not label_names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(label_names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_label_text(self.label_names, key)} {_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def set_max(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # по набору меток: [счетчики по корзинам (без накопления), сумма, количество]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _label_text(self.label_names + ("le",), key + (_number(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _label_text(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_number(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, label_names=()) -> Counter:
+        return self._add(Counter(name, help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names=()) -> Gauge:
+        return self._add(Gauge(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names=(), buckets=SECONDS_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, label_names, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # текстовый формат Prometheus (text/plain; version=0.0.4)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+PHASE_SECONDS = REGISTRY.histogram("ev_phase_seconds", "Длительность этапа сборки", ("phase",))
+PHASE_PEAK_RSS = REGISTRY.histogram(
+    "ev_phase_peak_rss_bytes", "Пиковая память процесса пула на этапе", ("phase",), BYTES_BUCKETS
+)
+PHASE_PEAK_RSS_MAX = REGISTRY.gauge("ev_phase_peak_rss_bytes_max", "Наибольшая пиковая память этапа с запуска", ("phase",))
+PHASE_ERRORS = REGISTRY.counter("ev_phase_errors_total", "Этапы, завершившиеся исключением", ("phase",))
+JOBS = REGISTRY.counter("ev_jobs_total", "Задачи очереди по результату", ("result",))
+JOB_SECONDS = REGISTRY.histogram("ev_job_seconds", "Длительность задачи от начала сборки до отправки")
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("ev_queue_wait_seconds", "Ожидание задачи в очереди")
+LIMIT_TRIPS_TOTAL = REGISTRY.counter("ev_limit_trips_total", "Сработавшие лимиты ресурсов", ("limit",))
+JOBS_QUEUED = REGISTRY.gauge("ev_jobs_queued", "Задачи, ждущие в очереди")
+JOBS_RUNNING = REGISTRY.gauge("ev_jobs_running", "Задачи, которые собираются сейчас")
+RENDER_PENDING = REGISTRY.gauge("ev_render_pending", "Вызовы пула процессов: выполняются и ждут")
+TELEGRAM_REQUESTS = REGISTRY.counter("ev_telegram_requests_total", "Запросы к Bot API по методу и итогу", ("method", "result"))
+TELEGRAM_RETRIES = REGISTRY.counter("ev_telegram_retries_total", "Повторы запросов к Bot API по причине", ("method", "reason"))
+TELEGRAM_WAIT_SECONDS = REGISTRY.histogram("ev_telegram_wait_seconds", "Ожидание запроса в лимитах сообщений")
+
+# замеры внутри процесса пула: копятся здесь на время задачи и уходят в бот вместе с результатом
+_collected = None
+# пиковая память вложенных этапов: у каждого открытого этапа — максимум, замеренный до сброса
+_peak_stack = []
+
+
+def _read_hwm():
+    # VmHWM — пик RSS процесса; на Linux его можно сбросить через /proc/self/clear_refs
+    try:
+        with open("/proc/self/status", "rb") as f:
+            match = re.search(rb"VmHWM:\s+(\d+)\s+kB", f.read())
+        if match:
+            return int(match.group(1)) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # без /proc — пик за все время жизни процесса (ru_maxrss в КБ на Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def _reset_hwm():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+@contextmanager
+def collect_phases():
+    # вызывается в процессе пула вокруг одной задачи; в процессе идет одна задача за раз,
+    # поэтому пиковая память этапа относится именно к ней
+    global _collected
+    _collected = []
+    try:
+        yield _collected
+    finally:
+        _collected = None
+        _peak_stack.clear()
+
+
+@contextmanager
+def phase(name: str, **fields):
+    # замер времени этапа; в процессе пула — еще и пиковой памяти.
+    # В боте этап сразу попадает в метрики и лог, в процессе пула — в список collect_phases
+    measure_memory = _collected is not None
+    if measure_memory:
+        if _peak_stack:
+            _peak_stack[-1] = max(_peak_stack[-1], _read_hwm() or 0)
+        _reset_hwm()
+        _peak_stack.append(0)
+    started = time.perf_counter()
+    error = None
+    try:
+        # в fields можно дописать подробности по ходу этапа (например, cached=True)
+        yield fields
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record = {"phase": name, "seconds": time.perf_counter() - started, **fields}
+        if error:
+            record["error"] = error
+        if measure_memory:
+            peak = max(_peak_stack.pop(), _read_hwm() or 0)
+            if _peak_stack:
+                _peak_stack[-1] = max(_peak_stack[-1], peak)
+            record["peak_rss_bytes"] = peak
+        if _collected is not None:
+            _collected.append(record)
+        else:
+            observe_phases([record])
+
+
+def observe_phases(records):
+    # записи этапов (из phase или из процесса пула) -> метрики и лог с id текущей задачи
+    for record in records:
+        name = record["phase"]
+        PHASE_SECONDS.observe(record["seconds"], phase=name)
+        if "peak_rss_bytes" in record:
+            PHASE_PEAK_RSS.observe(record["peak_rss_bytes"], phase=name)
+            PHASE_PEAK_RSS_MAX.set_max(record["peak_rss_bytes"], phase=name)
+        if "error" in record:
+            PHASE_ERRORS.inc(phase=name)
+        logger.info("phase", extra={"fields": record})
+
+
+def format_fields(fields: dict) -> str:
+    # logfmt: phase=render seconds=0.412 peak_rss_mb=180.2 sheet="Банкет"
+    parts = []
+    for key, value in fields.items():
+        if key == "seconds":
+            value = f"{value:.3f}"
+        elif key == "peak_rss_bytes":
+            key, value = "peak_rss_mb", f"{value / (1024 * 1024):.1f}"
+        elif isinstance(value, str) and (not value or re.search(r'[\s="]', value)):
+            value = '"' + _escape(value) + '"'
+        parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+
+class JobIdFilter(logging.Filter):
+    # добавляет в каждую запись id задачи из JOB_ID
+    def filter(self, record):
+        record.job_id = JOB_ID.get()
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s job=%(job_id)s %(message)s")
+
+    def format(self, record):
+        fields = getattr(record, "fields", None)
+        if fields:
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = f"{record.msg} {format_fields(fields)}"
+            record.args = None
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "job": getattr(record, "job_id", "-"),
+            "msg": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str, log_format: str):
+    handler = logging.StreamHandler()
+    handler.addFilter(JobIdFilter())
+    handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
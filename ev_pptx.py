@@ -1,6 +1,11 @@
-from pathlib import Path
+import hashlib
+import io
 from collections import defaultdict
+from copy import deepcopy
+from dataclasses import dataclass
+from typing import NamedTuple
 
+from lxml import etree
 from openpyxl import load_workbook
 from pptx import Presentation
 from pptx.util import Cm, Pt
@@ -8,8 +13,9 @@ from pptx.enum.text import PP_ALIGN
 from pptx.dml.color import RGBColor
 from pptx.oxml import parse_xml
 
+from ev_metrics import phase
+
 
-MAX_SCAN_ROWS = 400
 MAX_TABLE_HEIGHT_CM = 14.8
 ROW_HEIGHT_HEADER_CM = 1.92
 ROW_HEIGHT_DATA_CM = 0.7
@@ -20,9 +26,111 @@ COL2_WIDTH_CM = 2.9
 COL3_WIDTH_CM = 2.9
 COL4_WIDTH_CM = 3.5
 
-
-def load_book(path: Path):
-    return load_workbook(path, data_only=True)
+# меняется при любом изменении вида презентации, чтобы не отдавать устаревшие файлы из кеша
+RENDERER_VERSION = "1"
+
+# версия формата MenuModel: сохраненные модели другой версии не используются
+MENU_MODEL_VERSION = "1"
+
+# "clone" — строки таблицы копируются из заранее оформленных прототипов,
+# "classic" — каждая ячейка оформляется через python-pptx (медленнее, оставлено для сверки)
+RENDER_MODE_CLONE = "clone"
+RENDER_MODE_CLASSIC = "classic"
+
+# как презентация записывается в файл: "standard" — prs.save в конце,
+# "stream" — слайды пишутся в zip по мере сборки (память не растет с числом слайдов)
+PPTX_WRITER_STANDARD = "standard"
+PPTX_WRITER_STREAM = "stream"
+
+
+CATEGORY_SHEET_INDEX = 3
+AE_COL = 31
+
+DEFAULT_HDR_W = "Вес порции, грамм"
+DEFAULT_HDR_P = "Кол-во порций"
+DEFAULT_HDR_G = "Вес на одну персону, грамм"
+DEFAULT_LABEL_FOOD = "Итого выход напитков на персону, мл"
+DEFAULT_LABEL_LIQUID = "Итого выход напитков на персону, мл"
+
+
+@dataclass(frozen=True)
+class MenuSheet:
+    index: int
+    header_text: str
+    rows: tuple  # сырые значения B–F начиная со второй строки
+
+
+@dataclass(frozen=True)
+class WorkbookContext:
+    # всё, что нужно для сборки, читается из книги один раз и дальше не меняется
+    event_name: str
+    skip_columns: bool
+    # A1/B1/C1 служебного листа как есть — по ним отсекаются повторные шапки в данных
+    raw_hdr_w: str
+    raw_hdr_p: str
+    raw_hdr_g: str
+    # то же с подстановкой значений по умолчанию — для шапки таблицы на слайде
+    hdr_w: str
+    hdr_p: str
+    hdr_g: str
+    label_food: str
+    label_liquid: str
+    valid_categories: frozenset
+    category_order: tuple
+    sheets: tuple
+
+
+class MenuRow(NamedTuple):
+    # строка таблицы на слайде: категория или блюдо. NamedTuple не заводит __dict__ на каждую строку
+    # и распаковывается как обычный кортеж
+    is_category: bool
+    text: str
+    weight: object
+    portions: object
+    gpp: object
+
+
+@dataclass(frozen=True)
+class MenuSheetModel:
+    index: int
+    header_text: str
+    rows: tuple  # MenuRow в порядке вывода
+    total_food: float
+    total_liquid: float
+
+
+@dataclass(frozen=True)
+class MenuModel:
+    # разобранное меню без ячеек openpyxl: из него собираются слайды с любым фоном.
+    # Вес и порции хранятся всегда, skip_columns применяется только при сборке
+    event_name: str
+    skip_columns: bool
+    hdr_w: str
+    hdr_p: str
+    hdr_g: str
+    label_food: str
+    label_liquid: str
+    sheets: tuple  # MenuSheetModel, только листы, где есть что показать
+
+
+def load_book(source):
+    # source — путь к файлу или байты книги
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return load_workbook(source, read_only=True, data_only=True)
+
+
+def iter_values(ws, min_row: int, min_col: int, max_col: int, max_row=None):
+    # в read-only режиме размер листа берется из <dimension>, а его часто пишут неверно,
+    # поэтому сбрасываем и читаем строки до реального конца листа
+    ws.reset_dimensions()
+    return ws.iter_rows(
+        min_row=min_row,
+        max_row=max_row,
+        min_col=min_col,
+        max_col=max_col,
+        values_only=True,
+    )
 
 
 def get_skip_columns_flag(wb):
@@ -40,13 +148,58 @@ def get_headers_sheet(wb):
         raise RuntimeError("Нужен минимум 11 листов (служебный лист с заголовками).")
 
 
-def get_header_text(wb, ws, sheet_index: int):
-    ws1 = wb.worksheets[0]
-    ws11 = get_headers_sheet(wb)
+def read_headers(ws11) -> dict:
+    # A1:C12 служебного листа: заголовки колонок, подписи итогов и категории напитков
+    headers = {f"{col}{row}": None for row in range(1, 13) for col in "ABC"}
+    for row_idx, row in enumerate(iter_values(ws11, 1, 1, 3, max_row=12), start=1):
+        for col_letter, value in zip("ABC", row):
+            headers[f"{col_letter}{row_idx}"] = value
+    return headers
+
+
+def read_sheet1(ws1):
+    # B3 — название мероприятия, G1..G6 — подписи дней для листов 3–8
+    event_raw = None
+    day_labels = {row: None for row in range(1, 7)}
+    for row_idx, row in enumerate(iter_values(ws1, 1, 2, 7, max_row=6), start=1):
+        if row_idx == 3:
+            event_raw = row[0]
+        day_labels[row_idx] = row[5]
+    event_name = str(event_raw).strip() if event_raw else "Фуршет"
+    return event_name, day_labels
+
+
+def read_menu_sheet(ws, with_category_order: bool):
+    # один проход по листу: C1, строки B–F и (для листа 3) порядок категорий из AE3 и ниже
+    max_col = AE_COL if with_category_order else 6
+    title = None
+    rows = []
+    order = []
+    order_done = not with_category_order
+
+    for row_idx, row in enumerate(iter_values(ws, 1, 2, max_col), start=1):
+        if row_idx == 1:
+            title = row[1]
+            continue
+
+        rows.append(row[:5])
+
+        if not order_done and row_idx >= 3:
+            val = row[AE_COL - 2]
+            if val in (None, ""):
+                order_done = True
+            else:
+                val_str = str(val)
+                if val_str not in order:
+                    order.append(val_str)
+
+    return title, rows, order
+
 
-    c1 = ws["C1"].value or ""
-    g_val = ws1[f"G{sheet_index - 2}"].value or ""
-    a2 = ws11["A2"].value or ""
+def get_header_text(title, day_label, a2) -> str:
+    c1 = title or ""
+    g_val = day_label or ""
+    a2 = a2 or ""
 
     parts = [str(c1)]
     if g_val:
@@ -58,65 +211,73 @@ def get_header_text(wb, ws, sheet_index: int):
     return ", ".join(parts[:-1]) + " " + parts[-1]
 
 
-def collect_rows_for_sheet(wb, ws, skip_columns: bool):
-    ws11 = get_headers_sheet(wb)
-    hdr_w = str(ws11["A1"].value or "")
-    hdr_p = str(ws11["B1"].value or "")
-    hdr_g = str(ws11["C1"].value or "")
+def build_workbook_context(source) -> WorkbookContext:
+    wb = load_book(source)
+    try:
+        headers = read_headers(get_headers_sheet(wb))
+        event_name, day_labels = read_sheet1(wb.worksheets[0])
+        skip_columns = get_skip_columns_flag(wb)
+
+        sheets = []
+        category_order = []
+        for idx, ws in enumerate(wb.worksheets, start=1):
+            if 3 <= idx <= 8:
+                title, rows, order = read_menu_sheet(ws, idx == CATEGORY_SHEET_INDEX)
+                if idx == CATEGORY_SHEET_INDEX:
+                    category_order = order
+                header_text = get_header_text(title, day_labels.get(idx - 2), headers["A2"])
+                sheets.append(MenuSheet(idx, header_text, tuple(rows)))
+    finally:
+        wb.close()
+
+    valid_categories = set()
+    for row_idx in range(8, 13):
+        value = headers[f"A{row_idx}"]
+        if value not in (None, ""):
+            valid_categories.add(str(value))
+
+    return WorkbookContext(
+        event_name=event_name,
+        skip_columns=skip_columns,
+        raw_hdr_w=str(headers["A1"] or ""),
+        raw_hdr_p=str(headers["B1"] or ""),
+        raw_hdr_g=str(headers["C1"] or ""),
+        hdr_w=str(headers["A1"] or DEFAULT_HDR_W),
+        hdr_p=str(headers["B1"] or DEFAULT_HDR_P),
+        hdr_g=str(headers["C1"] or DEFAULT_HDR_G),
+        label_food=str(headers["A4"] or DEFAULT_LABEL_FOOD),
+        label_liquid=str(headers["A5"] or DEFAULT_LABEL_LIQUID),
+        valid_categories=frozenset(valid_categories),
+        category_order=tuple(category_order),
+        sheets=tuple(sheets),
+    )
+
+
+def collect_rows_for_sheet(ctx: WorkbookContext, sheet_rows):
+    hdr_w = ctx.raw_hdr_w
+    hdr_p = ctx.raw_hdr_p
+    hdr_g = ctx.raw_hdr_g
 
     rows_raw = []
-    last_row = min(ws.max_row, MAX_SCAN_ROWS)
 
-    for i in range(2, last_row + 1):
-        cell_E = ws[f"E{i}"].value
-        if cell_E is None or cell_E == 0:
+    for b_val, c_val, d_val, e_val, f_val in sheet_rows:
+        if e_val is None or e_val == 0:
             continue
 
-        cat_cell = str(ws[f"B{i}"].value or "")
-        name_cell = str(ws[f"C{i}"].value or "")
-        d_val = ws[f"D{i}"].value
-        e_val = ws[f"E{i}"].value
-        f_val = ws[f"F{i}"].value
+        cat_cell = str(b_val or "")
+        name_cell = str(c_val or "")
 
         if ("Категория блюд" in cat_cell) or ("Наименован" in name_cell) \
                 or (str(d_val) == hdr_w) or (str(e_val) == hdr_p) or (str(f_val) == hdr_g):
             continue
 
-        category = cat_cell
-        name = name_cell
-        weight = d_val if not skip_columns else None
-        portions = e_val if not skip_columns else None
-        g_per_person = f_val
-
-        rows_raw.append([category, name, weight, portions, g_per_person])
+        rows_raw.append([cat_cell, name_cell, d_val, e_val, f_val])
 
     return rows_raw
 
 
-def get_category_order_from_ae(wb):
-    ws_cat = wb.worksheets[2]
-    order = []
-    row = 3
-    while True:
-        val = ws_cat[f"AE{row}"].value
-        if val in (None, ""):
-            break
-        val_str = str(val)
-        if val_str not in order:
-            order.append(val_str)
-        row += 1
-    return order
-
-
-def build_master_rows_and_totals(wb, rows_raw, skip_columns: bool):
-    ws11 = get_headers_sheet(wb)
-
-    valid_categories = set()
-    for row in ws11["A8:A12"]:
-        for cell in row:
-            if cell.value not in (None, ""):
-                valid_categories.add(str(cell.value))
-
+def build_master_rows_and_totals(ctx: WorkbookContext, rows_raw):
+    valid_categories = ctx.valid_categories
     total_food = 0.0
     total_liquid = 0.0
 
@@ -137,7 +298,7 @@ def build_master_rows_and_totals(wb, rows_raw, skip_columns: bool):
         cat_to_rows[cat].append([category, name, weight, portions, gpp])
 
     categories_in_data = list(cat_to_rows.keys())
-    category_order_from_ae = get_category_order_from_ae(wb)
+    category_order_from_ae = ctx.category_order
 
     ordered_categories = []
     for cat in category_order_from_ae:
@@ -153,22 +314,37 @@ def build_master_rows_and_totals(wb, rows_raw, skip_columns: bool):
         if not dishes:
             continue
 
-        master_rows.append((True, cat, None, None, None))
+        master_rows.append(MenuRow(True, cat, None, None, None))
 
         for _, name, weight, portions, gpp in dishes:
-            master_rows.append(
-                (
-                    False,
-                    str(name or ""),
-                    weight if not skip_columns else None,
-                    portions if not skip_columns else None,
-                    gpp,
-                )
-            )
+            master_rows.append(MenuRow(False, str(name or ""), weight, portions, gpp))
 
     return master_rows, total_food, total_liquid
 
 
+def build_menu_model(ctx: WorkbookContext) -> MenuModel:
+    sheets = []
+    for sheet in ctx.sheets:
+        rows_raw = collect_rows_for_sheet(ctx, sheet.rows)
+        if not rows_raw:
+            continue
+        master_rows, total_food, total_liquid = build_master_rows_and_totals(ctx, rows_raw)
+        if not master_rows:
+            continue
+        sheets.append(MenuSheetModel(sheet.index, sheet.header_text, tuple(master_rows), total_food, total_liquid))
+
+    return MenuModel(
+        event_name=ctx.event_name,
+        skip_columns=ctx.skip_columns,
+        hdr_w=ctx.hdr_w,
+        hdr_p=ctx.hdr_p,
+        hdr_g=ctx.hdr_g,
+        label_food=ctx.label_food,
+        label_liquid=ctx.label_liquid,
+        sheets=tuple(sheets),
+    )
+
+
 def split_master_rows_to_slides(master_rows):
     max_rows_per_slide = int(
         (MAX_TABLE_HEIGHT_CM - ROW_HEIGHT_HEADER_CM) / ROW_HEIGHT_DATA_CM
@@ -199,41 +375,50 @@ def set_table_style_no_grid(table):
     tbl.insert(0, new_tblPr)
 
 
-def create_slide_with_table(
-    prs,
-    header_text,
-    bg_image_path: Path,
-    slide_rows,
-    skip_columns,
-    is_last_slide,
-    total_food_per_person,
-    total_liquid_per_person,
-):
-    data_rows = len(slide_rows)
-    extra_rows = 3 if is_last_slide else 0
-    total_rows = 1 + data_rows + extra_rows
+@dataclass(frozen=True)
+class RowPrototypes:
+    # готовые <a:tr> со всеми стилями; при сборке слайда копируются и в них меняется только текст
+    header: object
+    category: object
+    dish: object
+    blank: object
+    food: object
+    liquid: object
 
-    slide = prs.slides.add_slide(prs.slide_layouts[6])
 
-    if bg_image_path.exists():
-        slide.shapes.add_picture(
-            str(bg_image_path),
-            left=0,
-            top=0,
-            width=prs.slide_width,
-            height=prs.slide_height,
-        )
-
-    tb = slide.shapes.add_textbox(Cm(1.5), Cm(1.0), prs.slide_width - Cm(3), Cm(1.8))
-    tf = tb.text_frame
+def fill_cell(cell, text, align, bold=None):
+    tf = cell.text_frame
     tf.clear()
     p = tf.paragraphs[0]
-    p.text = header_text
+    p.text = text
+    if bold is not None:
+        p.font.bold = bold
     p.font.name = "Century Gothic"
-    p.font.size = Pt(20)
+    p.font.size = Pt(10)
     p.font.color.rgb = RGBColor(0, 0, 0)
-    p.alignment = PP_ALIGN.LEFT
+    p.alignment = align
+
 
+def format_number(value) -> str:
+    return f"{float(value):.2f}".replace(".", ",")
+
+
+def data_row_texts(row, skip_columns):
+    is_category, text, weight, portions, gpp = row
+
+    if is_category:
+        return text or "", "", "", ""
+
+    w_text = "" if (skip_columns or weight is None) else str(weight)
+    q_text = "" if (skip_columns or portions is None) else str(portions)
+    if isinstance(gpp, (int, float)):
+        g_text = format_number(gpp)
+    else:
+        g_text = "" if gpp is None else str(gpp)
+    return text or "", w_text, q_text, g_text
+
+
+def add_table(slide, prs, total_rows):
     table_total_width = Cm(
         COL1_WIDTH_CM + COL2_WIDTH_CM + COL3_WIDTH_CM + COL4_WIDTH_CM
     )
@@ -251,6 +436,10 @@ def create_slide_with_table(
     table.columns[2].width = Cm(COL3_WIDTH_CM)
     table.columns[3].width = Cm(COL4_WIDTH_CM)
 
+    return table
+
+
+def style_table(table, total_rows):
     table.rows[0].height = Cm(ROW_HEIGHT_HEADER_CM)
     for r in range(1, total_rows):
         table.rows[r].height = Cm(ROW_HEIGHT_DATA_CM)
@@ -261,215 +450,216 @@ def create_slide_with_table(
             cell.fill.background()
             cell.margin_left = Cm(0)
             cell.margin_right = Cm(0)
-            tf = cell.text_frame
-            tf.clear()
-            p = tf.paragraphs[0]
-            p.font.name = "Century Gothic"
-            p.font.size = Pt(10)
-            p.font.color.rgb = RGBColor(0, 0, 0)
-            p.alignment = PP_ALIGN.LEFT
-
-    ws11 = getattr(prs, "_headers_ws", None)
-
-    hdr_w = "Вес порции, грамм"
-    hdr_p = "Кол-во порций"
-    hdr_g = "Вес на одну персону, грамм"
-    label_food = "Итого выход напитков на персону, мл"
-    label_liquid = "Итого выход напитков на персону, мл"
-
-    if ws11 is not None:
-        hdr_w = str(ws11["A1"].value or hdr_w)
-        hdr_p = str(ws11["B1"].value or hdr_p)
-        hdr_g = str(ws11["C1"].value or hdr_g)
-        label_food = str(ws11["A4"].value or label_food)
-        label_liquid = str(ws11["A5"].value or label_liquid)
-
-    cell = table.cell(0, 0)
-    tf = cell.text_frame
-    tf.clear()
-    p = tf.paragraphs[0]
-    p.text = "Наименования блюд"
-    p.font.bold = True
-    p.font.name = "Century Gothic"
-    p.font.size = Pt(10)
-    p.font.color.rgb = RGBColor(0, 0, 0)
-    p.alignment = PP_ALIGN.CENTER
+            fill_cell(cell, "", PP_ALIGN.LEFT)
 
-    if skip_columns:
+
+def fill_header_row(table, model: MenuModel):
+    fill_cell(table.cell(0, 0), "Наименования блюд", PP_ALIGN.CENTER, bold=True)
+
+    if model.skip_columns:
         table.cell(0, 1).text = ""
         table.cell(0, 2).text = ""
     else:
-        cell = table.cell(0, 1)
-        tf = cell.text_frame
-        tf.clear()
-        p = tf.paragraphs[0]
-        p.text = hdr_w
-        p.font.bold = True
-        p.font.name = "Century Gothic"
-        p.font.size = Pt(10)
-        p.font.color.rgb = RGBColor(0, 0, 0)
-        p.alignment = PP_ALIGN.CENTER
-
-        cell = table.cell(0, 2)
-        tf = cell.text_frame
-        tf.clear()
-        p = tf.paragraphs[0]
-        p.text = hdr_p
-        p.font.bold = True
-        p.font.name = "Century Gothic"
-        p.font.size = Pt(10)
-        p.font.color.rgb = RGBColor(0, 0, 0)
-        p.alignment = PP_ALIGN.CENTER
-
-    cell = table.cell(0, 3)
-    tf = cell.text_frame
+        fill_cell(table.cell(0, 1), model.hdr_w, PP_ALIGN.CENTER, bold=True)
+        fill_cell(table.cell(0, 2), model.hdr_p, PP_ALIGN.CENTER, bold=True)
+
+    fill_cell(table.cell(0, 3), model.hdr_g, PP_ALIGN.CENTER, bold=True)
+
+
+def fill_data_row(table, row_idx, row, skip_columns):
+    is_category = row[0]
+    name_text, w_text, q_text, g_text = data_row_texts(row, skip_columns)
+
+    cell = table.cell(row_idx, 0)
+    if is_category:
+        cell.margin_left = Cm(0)
+    else:
+        cell.margin_left = Cm(0.6)
+    fill_cell(cell, name_text, PP_ALIGN.LEFT, bold=bool(is_category))
+
+    fill_cell(table.cell(row_idx, 1), w_text, PP_ALIGN.CENTER)
+    fill_cell(table.cell(row_idx, 2), q_text, PP_ALIGN.CENTER)
+    fill_cell(table.cell(row_idx, 3), g_text, PP_ALIGN.CENTER)
+
+
+def fill_totals_rows(table, model: MenuModel, total_food_per_person, total_liquid_per_person):
+    total_rows = len(table.rows)
+    if total_rows < 4:
+        return
+
+    row_blank = total_rows - 3
+    row_food = total_rows - 2
+    row_liquid = total_rows - 1
+
+    for c in range(4):
+        table.cell(row_blank, c).text = ""
+
+    fill_cell(table.cell(row_food, 0), model.label_food + ":", PP_ALIGN.LEFT, bold=True)
+    table.cell(row_food, 0).text_frame.margin_left = Cm(0)
+    fill_cell(table.cell(row_food, 3), format_number(total_food_per_person), PP_ALIGN.CENTER, bold=True)
+
+    fill_cell(table.cell(row_liquid, 0), model.label_liquid + ":", PP_ALIGN.LEFT, bold=True)
+    table.cell(row_liquid, 0).text_frame.margin_left = Cm(0)
+    fill_cell(table.cell(row_liquid, 3), format_number(total_liquid_per_person), PP_ALIGN.CENTER, bold=True)
+
+
+def build_row_prototypes(model: MenuModel) -> RowPrototypes:
+    # прототипы строк собираются тем же кодом, что и обычная таблица, на черновом слайде
+    scratch = Presentation()
+    slide = scratch.slides.add_slide(scratch.slide_layouts[6])
+    table = add_table(slide, scratch, 6)
+    style_table(table, 6)
+    fill_header_row(table, model)
+    fill_data_row(table, 1, MenuRow(True, "", None, None, None), model.skip_columns)
+    fill_data_row(table, 2, MenuRow(False, "", None, None, None), model.skip_columns)
+    fill_totals_rows(table, model, 0, 0)
+
+    rows = table._tbl.tr_lst
+    for tr in rows:
+        tr.getparent().remove(tr)
+    return RowPrototypes(*rows)
+
+
+def set_tc_text(tc, text):
+    p = tc.txBody.p_lst[0]
+    p.remove_all("a:r", "a:br", "a:fld")
+    p.append_text(text)
+
+
+def clone_row(prototype, texts):
+    tr = deepcopy(prototype)
+    for tc, text in zip(tr.tc_lst, texts):
+        if text is not None:
+            set_tc_text(tc, text)
+    return tr
+
+
+def fill_table_from_prototypes(
+    table,
+    prototypes: RowPrototypes,
+    slide_rows,
+    skip_columns,
+    is_last_slide,
+    total_food_per_person,
+    total_liquid_per_person,
+):
+    tbl = table._tbl
+    for tr in tbl.tr_lst:
+        tbl.remove(tr)
+
+    tbl.append(deepcopy(prototypes.header))
+
+    for row in slide_rows:
+        prototype = prototypes.category if row[0] else prototypes.dish
+        tbl.append(clone_row(prototype, data_row_texts(row, skip_columns)))
+
+    if is_last_slide:
+        tbl.append(deepcopy(prototypes.blank))
+        tbl.append(clone_row(prototypes.food, (None, None, None, format_number(total_food_per_person))))
+        tbl.append(clone_row(prototypes.liquid, (None, None, None, format_number(total_liquid_per_person))))
+
+    # высота рамки таблицы — сумма высот строк, как после установки row.height в python-pptx
+    table.notify_height_changed()
+
+
+def add_background_layout(prs, bg_image):
+    # фон кладется один раз в <p:bg> макета, все слайды наследуют его от макета;
+    # bg_image — путь к файлу или байты картинки
+    layout = prs.slide_layouts[6]
+    if isinstance(bg_image, (bytes, bytearray)):
+        image_file = io.BytesIO(bg_image)
+    elif bg_image.exists():
+        image_file = str(bg_image)
+    else:
+        return layout
+
+    _, rId = layout.part.get_or_add_image_part(image_file)
+    bg_xml = f"""
+    <p:bg xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"
+          xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main"
+          xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+      <p:bgPr>
+        <a:blipFill dpi="0" rotWithShape="1">
+          <a:blip r:embed="{rId}"/>
+          <a:srcRect/>
+          <a:stretch><a:fillRect/></a:stretch>
+        </a:blipFill>
+        <a:effectLst/>
+      </p:bgPr>
+    </p:bg>
+    """
+    cSld = layout._element.cSld
+    existing_bg = cSld.xpath('./p:bg')
+    if existing_bg:
+        cSld.remove(existing_bg[0])
+    cSld.insert(0, parse_xml(bg_xml))
+    return layout
+
+
+def create_slide_with_table(
+    prs,
+    model: MenuModel,
+    header_text,
+    layout,
+    slide_rows,
+    is_last_slide,
+    total_food_per_person,
+    total_liquid_per_person,
+    prototypes: RowPrototypes = None,
+):
+    data_rows = len(slide_rows)
+    extra_rows = 3 if is_last_slide else 0
+    total_rows = 1 + data_rows + extra_rows
+
+    slide = prs.slides.add_slide(layout)
+
+    tb = slide.shapes.add_textbox(Cm(1.5), Cm(1.0), prs.slide_width - Cm(3), Cm(1.8))
+    tf = tb.text_frame
     tf.clear()
     p = tf.paragraphs[0]
-    p.text = hdr_g
-    p.font.bold = True
+    p.text = header_text
     p.font.name = "Century Gothic"
-    p.font.size = Pt(10)
+    p.font.size = Pt(20)
     p.font.color.rgb = RGBColor(0, 0, 0)
-    p.alignment = PP_ALIGN.CENTER
+    p.alignment = PP_ALIGN.LEFT
 
-    for idx, row in enumerate(slide_rows, start=0):
-        is_category, text, weight, portions, gpp = row
-        row_idx = 1 + idx
+    if prototypes is not None:
+        table = add_table(slide, prs, 1)
+        fill_table_from_prototypes(
+            table,
+            prototypes,
+            slide_rows,
+            model.skip_columns,
+            is_last_slide,
+            total_food_per_person,
+            total_liquid_per_person,
+        )
+        return
 
-        cell = table.cell(row_idx, 0)
-        if is_category:
-            cell.margin_left = Cm(0)
-        else:
-            cell.margin_left = Cm(0.6)
-
-        tf = cell.text_frame
-        tf.clear()
-        p = tf.paragraphs[0]
-        p.text = text or ""
-        p.font.name = "Century Gothic"
-        p.font.size = Pt(10)
-        p.font.bold = bool(is_category)
-        p.font.color.rgb = RGBColor(0, 0, 0)
-        p.alignment = PP_ALIGN.LEFT
-
-        if is_category:
-            w_text = ""
-            q_text = ""
-            g_text = ""
-        else:
-            w_text = "" if (skip_columns or weight is None) else str(weight)
-            q_text = "" if (skip_columns or portions is None) else str(portions)
-            if isinstance(gpp, (int, float)):
-                g_text = f"{float(gpp):.2f}".replace(".", ",")
-            else:
-                g_text = "" if gpp is None else str(gpp)
-
-        cell = table.cell(row_idx, 1)
-        tf = cell.text_frame
-        tf.clear()
-        p = tf.paragraphs[0]
-        p.text = w_text
-        p.font.name = "Century Gothic"
-        p.font.size = Pt(10)
-        p.font.color.rgb = RGBColor(0, 0, 0)
-        p.alignment = PP_ALIGN.CENTER
-
-        cell = table.cell(row_idx, 2)
-        tf = cell.text_frame
-        tf.clear()
-        p = tf.paragraphs[0]
-        p.text = q_text
-        p.font.name = "Century Gothic"
-        p.font.size = Pt(10)
-        p.font.color.rgb = RGBColor(0, 0, 0)
-        p.alignment = PP_ALIGN.CENTER
-
-        cell = table.cell(row_idx, 3)
-        tf = cell.text_frame
-        tf.clear()
-        p = tf.paragraphs[0]
-        p.text = g_text
-        p.font.name = "Century Gothic"
-        p.font.size = Pt(10)
-        p.font.color.rgb = RGBColor(0, 0, 0)
-        p.alignment = PP_ALIGN.CENTER
+    table = add_table(slide, prs, total_rows)
+    style_table(table, total_rows)
+    fill_header_row(table, model)
+
+    for idx, row in enumerate(slide_rows, start=0):
+        fill_data_row(table, 1 + idx, row, model.skip_columns)
 
     if is_last_slide:
-        total_rows = len(table.rows)
-        if total_rows >= 4:
-            row_blank = total_rows - 3
-            row_food = total_rows - 2
-            row_liquid = total_rows - 1
-
-            for c in range(4):
-                table.cell(row_blank, c).text = ""
-
-            cell = table.cell(row_food, 0)
-            tf = cell.text_frame
-            tf.clear()
-            p = tf.paragraphs[0]
-            p.text = label_food + ":"
-            p.font.name = "Century Gothic"
-            p.font.size = Pt(10)
-            p.font.bold = True
-            p.font.color.rgb = RGBColor(0, 0, 0)
-            p.alignment = PP_ALIGN.LEFT
-            tf.margin_left = Cm(0)
-
-            cell = table.cell(row_food, 3)
-            tf = cell.text_frame
-            tf.clear()
-            p = tf.paragraphs[0]
-            p.text = f"{total_food_per_person:.2f}".replace(".", ",")
-            p.font.name = "Century Gothic"
-            p.font.size = Pt(10)
-            p.font.bold = True
-            p.font.color.rgb = RGBColor(0, 0, 0)
-            p.alignment = PP_ALIGN.CENTER
-
-            cell = table.cell(row_liquid, 0)
-            tf = cell.text_frame
-            tf.clear()
-            p = tf.paragraphs[0]
-            p.text = label_liquid + ":"
-            p.font.name = "Century Gothic"
-            p.font.size = Pt(10)
-            p.font.bold = True
-            p.font.color.rgb = RGBColor(0, 0, 0)
-            p.alignment = PP_ALIGN.LEFT
-            tf.margin_left = Cm(0)
-
-            cell = table.cell(row_liquid, 3)
-            tf = cell.text_frame
-            tf.clear()
-            p = tf.paragraphs[0]
-            p.text = f"{total_liquid_per_person:.2f}".replace(".", ",")
-            p.font.name = "Century Gothic"
-            p.font.size = Pt(10)
-            p.font.bold = True
-            p.font.color.rgb = RGBColor(0, 0, 0)
-            p.alignment = PP_ALIGN.CENTER
+        fill_totals_rows(table, model, total_food_per_person, total_liquid_per_person)
 
 
 def process_sheet(
-    wb,
-    ws,
-    sheet_index: int,
+    model: MenuModel,
+    sheet: MenuSheetModel,
     prs: Presentation,
-    bg_image_path: Path,
-    skip_columns: bool,
+    layout,
+    prototypes: RowPrototypes = None,
+    on_slide_added=None,
 ):
-    rows_raw = collect_rows_for_sheet(wb, ws, skip_columns)
-    if not rows_raw:
-        return
-
-    master_rows, total_food_per_person, total_liquid_per_person = build_master_rows_and_totals(
-        wb, rows_raw, skip_columns
-    )
-    if not master_rows:
-        return
+    # on_slide_added() вызывается после каждого слайда — так потоковая запись забирает слайды по одному
+    total_food_per_person = sheet.total_food
+    total_liquid_per_person = sheet.total_liquid
 
-    slides = split_master_rows_to_slides(master_rows)
+    slides = split_master_rows_to_slides(sheet.rows)
     if not slides:
         return
 
@@ -477,43 +667,173 @@ def process_sheet(
     main_height_last = ROW_HEIGHT_HEADER_CM + last_rows_count * ROW_HEIGHT_DATA_CM
     can_place_totals_on_last = main_height_last <= MAIN_HEIGHT_LAST_CM
 
-    header_text = get_header_text(wb, ws, sheet_index)
+    header_text = sheet.header_text
 
     for idx, slide_rows in enumerate(slides, start=1):
         is_last = (idx == len(slides)) and can_place_totals_on_last
         create_slide_with_table(
             prs,
+            model,
             header_text,
-            bg_image_path,
+            layout,
             slide_rows,
-            skip_columns,
             is_last,
             total_food_per_person,
             total_liquid_per_person,
+            prototypes,
         )
+        if on_slide_added is not None:
+            on_slide_added()
 
     if not can_place_totals_on_last:
         create_slide_with_table(
             prs,
+            model,
             header_text,
-            bg_image_path,
+            layout,
             [],
-            skip_columns,
             True,
             total_food_per_person,
             total_liquid_per_person,
+            prototypes,
         )
+        if on_slide_added is not None:
+            on_slide_added()
+
+
+def sheet_fingerprint(model: MenuModel, sheet: MenuSheetModel, render_mode: str) -> str:
+    # все, от чего зависят слайды листа; фон в слайды не входит (он в макете)
+    data = (
+        RENDERER_VERSION,
+        render_mode,
+        model.skip_columns,
+        model.hdr_w,
+        model.hdr_p,
+        model.hdr_g,
+        model.label_food,
+        model.label_liquid,
+        sheet.header_text,
+        sheet.rows,
+        sheet.total_food,
+        sheet.total_liquid,
+    )
+    return hashlib.sha256(repr(data).encode("utf-8")).hexdigest()
+
+
+def slides_xml(slides) -> list:
+    return [etree.tostring(slide.shapes._spTree) for slide in slides]
+
+
+def append_sheet_slides(prs, layout, slides):
+    # slides — XML <p:spTree> слайдов листа. Слайды не ссылаются на другие части пакета,
+    # поэтому переносятся в презентацию как есть
+    for sp_tree_xml in slides:
+        slide = prs.slides.add_slide(layout)
+        sp_tree = slide.shapes._spTree
+        sp_tree.getparent().replace(sp_tree, parse_xml(sp_tree_xml))
+
+
+def open_stream_writer(prs, out, writer: str):
+    # потоковая запись опирается на внутренности python-pptx (см. ev_stream), поэтому импортируется,
+    # только когда выбрана: несовместимое обновление python-pptx не ломает запись standard
+    if writer != PPTX_WRITER_STREAM:
+        return None
+    from ev_stream import StreamingDeckWriter
+
+    return StreamingDeckWriter(prs, out)
+
+
+def render_book(
+    model: MenuModel,
+    bg_image,
+    out,
+    render_mode: str = RENDER_MODE_CLONE,
+    sheet_cache=None,
+    writer: str = PPTX_WRITER_STANDARD,
+):
+    # out — путь или файлоподобный объект (например, io.BytesIO).
+    # sheet_cache — хранилище слайдов по sheet_fingerprint (get/put): неизменившиеся листы
+    # не собираются заново, а копируются из прошлых сборок
+    prs = Presentation()
+    layout = add_background_layout(prs, bg_image)
+    prototypes = None
+    stream = open_stream_writer(prs, out, writer)
+
+    for sheet in model.sheets:
+        with phase("sheet", sheet=sheet.index, rows=len(sheet.rows)) as fields:
+            key = None
+            if sheet_cache is not None:
+                key = sheet_fingerprint(model, sheet, render_mode)
+                cached = sheet_cache.get(key)
+                fields["cached"] = cached is not None
+                if cached is not None:
+                    append_sheet_slides(prs, layout, cached)
+                    if stream is not None:
+                        stream.flush()
+                    continue
+
+            if prototypes is None and render_mode == RENDER_MODE_CLONE:
+                prototypes = build_row_prototypes(model)
+
+            # XML слайдов листа для кеша снимается до того, как поток заберет слайд из prs
+            sheet_slides = []
+
+            def on_slide_added():
+                if key is not None:
+                    sheet_slides.extend(slides_xml([prs.slides[-1]]))
+                if stream is not None:
+                    stream.flush()
+
+            process_sheet(model, sheet, prs, layout, prototypes, on_slide_added)
+            if key is not None:
+                sheet_cache.put(key, sheet_slides)
+
+    with phase("save", writer=writer):
+        if stream is not None:
+            stream.close()
+        else:
+            prs.save(out)
+    return out
+
+
+def render_sheet_slides(
+    model: MenuModel,
+    sheet: MenuSheetModel,
+    render_mode: str = RENDER_MODE_CLONE,
+) -> list:
+    # слайды одного листа для параллельной сборки: XML <p:spTree> каждого слайда
+    prs = Presentation()
+    layout = prs.slide_layouts[6]
+    prototypes = build_row_prototypes(model) if render_mode == RENDER_MODE_CLONE else None
+    process_sheet(model, sheet, prs, layout, prototypes)
+    return slides_xml(prs.slides)
 
 
-def build_presentation(excel_path: Path, bg_image_path: Path, out_path: Path) -> Path:
-    wb = load_book(excel_path)
+def merge_sheet_slides(bg_image, sheet_slides, out, writer: str = PPTX_WRITER_STANDARD):
+    # sheet_slides — результаты render_sheet_slides в порядке листов
     prs = Presentation()
-    prs._headers_ws = get_headers_sheet(wb)  # type: ignore
-    skip_columns = get_skip_columns_flag(wb)
+    layout = add_background_layout(prs, bg_image)
+    stream = open_stream_writer(prs, out, writer)
+
+    for slides in sheet_slides:
+        append_sheet_slides(prs, layout, slides)
+        if stream is not None:
+            stream.flush()
 
-    for idx, ws in enumerate(wb.worksheets, start=1):
-        if 3 <= idx <= 8:
-            process_sheet(wb, ws, idx, prs, bg_image_path, skip_columns)
+    if stream is not None:
+        stream.close()
+    else:
+        prs.save(out)
+    return out
 
-    prs.save(out_path)
-    return out_path
+
+def build_presentation(
+    excel,
+    bg_image,
+    out,
+    render_mode: str = RENDER_MODE_CLONE,
+    writer: str = PPTX_WRITER_STANDARD,
+):
+    # каждый аргумент может быть путем; excel и bg_image — еще и байтами, out — файлоподобным объектом
+    model = build_menu_model(build_workbook_context(excel))
+    return render_book(model, bg_image, out, render_mode, writer=writer)
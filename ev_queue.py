@@ -0,0 +1,163 @@
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    # очередь сборок в SQLite: переживает перезапуск, одинаковые отправки одного чата не дублируются,
+    # а чаты обслуживаются по кругу — десяток отправок одного менеджера не задерживает остальных.
+    # Задача хранится pickle-ом, как сессия. Байты файлов (режим IN_MEMORY_JOBS) в базу не пишутся —
+    # они живут в памяти процесса, и после перезапуска такая задача приходит с пометкой payload_lost.
+    # Все методы блокируются на SQLite: из event loop их вызывают через asyncio.to_thread
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # id задачи -> {поле: байты}
+        self._payloads = {}
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " chat_id INTEGER NOT NULL,"
+            " dedupe_key TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " msg_id INTEGER,"
+            " job_dir TEXT NOT NULL,"
+            " data BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_chat ON jobs(chat_id, dedupe_key)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chats ("
+            " chat_id INTEGER PRIMARY KEY,"
+            " last_started REAL NOT NULL)"
+        )
+
+    def requeue_running(self) -> int:
+        # задачи, которые собирались при остановке бота, начнутся заново. Вызывается только
+        # при запуске бота: процессы пула (spawn) тоже импортируют ev_bot и открывают очередь
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET state = ? WHERE state = ?",
+                (STATE_QUEUED, STATE_RUNNING),
+            )
+        return cur.rowcount
+
+    def submit(self, chat_id: int, dedupe_key: str, job: dict):
+        # (id задачи, True) — задача добавлена; (id такой же задачи чата, False) — она уже в очереди
+        payload = {key: value for key, value in job.items() if isinstance(value, (bytes, bytearray))}
+        stored = {key: value for key, value in job.items() if key not in payload}
+        stored["payload_keys"] = list(payload)
+        data = pickle.dumps(stored, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE chat_id = ? AND dedupe_key = ?",
+                (chat_id, dedupe_key),
+            ).fetchone()
+            if row:
+                return row[0], False
+            cur = self._conn.execute(
+                "INSERT INTO jobs (chat_id, dedupe_key, state, created, msg_id, job_dir, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, dedupe_key, STATE_QUEUED, time.time(), job.get("msg_id"), str(job["job_dir"]), data),
+            )
+            if payload:
+                self._payloads[cur.lastrowid] = payload
+            return cur.lastrowid, True
+
+    def _order(self):
+        # ожидаемый порядок запуска: по одной задаче от каждого чата за круг. Первыми идут чаты,
+        # у которых сейчас ничего не собирается и которые дольше всех ждали; внутри чата — по порядку отправки
+        queued = self._conn.execute(
+            "SELECT id, chat_id, msg_id FROM jobs WHERE state = ? ORDER BY id",
+            (STATE_QUEUED,),
+        ).fetchall()
+        running = dict(self._conn.execute(
+            "SELECT chat_id, COUNT(*) FROM jobs WHERE state = ? GROUP BY chat_id",
+            (STATE_RUNNING,),
+        ).fetchall())
+        last_started = dict(self._conn.execute("SELECT chat_id, last_started FROM chats").fetchall())
+
+        per_chat = OrderedDict()
+        for row in queued:
+            per_chat.setdefault(row[1], deque()).append(row)
+        chats = sorted(
+            per_chat,
+            key=lambda c: (running.get(c, 0), last_started.get(c, 0.0), per_chat[c][0][0]),
+        )
+
+        order = []
+        while len(order) < len(queued):
+            for chat_id in chats:
+                if per_chat[chat_id]:
+                    order.append(per_chat[chat_id].popleft())
+        return order
+
+    def positions(self):
+        # [(id задачи, chat_id, msg_id, место в очереди начиная с 1)]
+        with self._lock:
+            order = self._order()
+        return [(job_id, chat_id, msg_id, pos) for pos, (job_id, chat_id, msg_id) in enumerate(order, start=1)]
+
+    def claim_next(self):
+        # следующая задача по очереди переходит в running: (id, чат, задача, время постановки в очередь);
+        # None — очередь пуста
+        while True:
+            with self._lock:
+                order = self._order()
+                if not order:
+                    return None
+                job_id, chat_id, _ = order[0]
+                now = time.time()
+                self._conn.execute("UPDATE jobs SET state = ? WHERE id = ?", (STATE_RUNNING, job_id))
+                self._conn.execute(
+                    "INSERT INTO chats (chat_id, last_started) VALUES (?, ?) "
+                    "ON CONFLICT(chat_id) DO UPDATE SET last_started = excluded.last_started",
+                    (chat_id, now),
+                )
+                row = self._conn.execute("SELECT data, created FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                payload = self._payloads.get(job_id)
+            try:
+                job = pickle.loads(row[0])
+            except Exception:
+                # битая запись или задача, сохраненная кодом, которого уже нет: иначе она стояла бы первой вечно
+                logger.exception("Задача %s чата %s не читается и удалена из очереди", job_id, chat_id)
+                self.finish(job_id)
+                continue
+            break
+        keys = job.pop("payload_keys", ())
+        if keys and payload is None:
+            job["payload_lost"] = True
+        else:
+            job.update(payload or {})
+        return job_id, chat_id, job, row[1]
+
+    def finish(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._payloads.pop(job_id, None)
+
+    def queued_count(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (STATE_QUEUED,)).fetchone()
+        return row[0]
+
+    def job_dirs(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT job_dir FROM jobs").fetchall()
+        return [Path(row[0]) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
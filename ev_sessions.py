@@ -0,0 +1,130 @@
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class MemorySessionStore:
+    # сессии в памяти процесса: ограничены по числу и по времени с последнего изменения
+    blocking = False
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+
+    def get(self, chat_id: int):
+        item = self._items.get(chat_id)
+        if item is None:
+            return None
+        updated, session = item
+        if time.time() - updated > self.ttl_seconds:
+            del self._items[chat_id]
+            return None
+        return session
+
+    def set(self, chat_id: int, session: dict):
+        self._items[chat_id] = (time.time(), session)
+        self._items.move_to_end(chat_id)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def pop(self, chat_id: int):
+        item = self._items.pop(chat_id, None)
+        return item[1] if item else None
+
+    def values(self):
+        now = time.time()
+        return [s for updated, s in self._items.values() if now - updated <= self.ttl_seconds]
+
+    def expire(self) -> int:
+        now = time.time()
+        expired = [cid for cid, (updated, _) in self._items.items() if now - updated > self.ttl_seconds]
+        for cid in expired:
+            del self._items[cid]
+        return len(expired)
+
+    def close(self):
+        pass
+
+
+class SqliteSessionStore:
+    # то же в SQLite: сессии переживают перезапуск контейнера.
+    # Сессия хранится pickle-ом (в ней пути к файлам); методы ждут диск, поэтому бот вызывает их в потоке
+    blocking = True
+
+    def __init__(self, db_path: Path, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " chat_id INTEGER PRIMARY KEY,"
+            " updated REAL NOT NULL,"
+            " data BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated)")
+
+    def get(self, chat_id: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE chat_id = ? AND updated >= ?",
+                (chat_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, chat_id: int, session: dict):
+        data = pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (chat_id, updated, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET updated = excluded.updated, data = excluded.data",
+                (chat_id, time.time(), data),
+            )
+            self._conn.execute(
+                "DELETE FROM sessions WHERE chat_id NOT IN "
+                "(SELECT chat_id FROM sessions ORDER BY updated DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def pop(self, chat_id: int):
+        session = self.get(chat_id)
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+        return session
+
+    def values(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM sessions WHERE updated >= ?",
+                (time.time() - self.ttl_seconds,),
+            ).fetchall()
+        return [pickle.loads(row[0]) for row in rows]
+
+    def expire(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM sessions WHERE updated < ?",
+                (time.time() - self.ttl_seconds,),
+            )
+        return cur.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(backend: str, db_path: Path, ttl_seconds: int, max_entries: int, in_memory_jobs: bool = False):
+    if backend == "sqlite":
+        if in_memory_jobs:
+            # в режиме IN_MEMORY_JOBS в сессии лежат сами файлы: каждое изменение переписывало бы их в базу
+            raise RuntimeError("SESSION_BACKEND=sqlite нельзя совмещать с IN_MEMORY_JOBS=1")
+        return SqliteSessionStore(db_path, ttl_seconds, max_entries)
+    if backend == "memory":
+        return MemorySessionStore(ttl_seconds, max_entries)
+    raise RuntimeError(f"Неизвестный SESSION_BACKEND: {backend}")
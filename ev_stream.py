@@ -0,0 +1,67 @@
+import zipfile
+
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from pptx.opc.package import Part
+from pptx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI, PackURI
+from pptx.opc.oxml import serialize_part_xml
+from pptx.opc.serialized import _ContentTypesItem
+
+# модуль использует внутренности python-pptx (_ContentTypesItem, package._rels, slides._sldIdLst) и проверен
+# на версии из requirements.txt; ev_pptx импортирует его только для PPTX_WRITER=stream
+
+
+class StreamingDeckWriter:
+    # пишет презентацию в zip по мере сборки: готовые слайды сериализуются и удаляются из prs,
+    # поэтому в памяти одновременно только слайды текущего листа, а не вся презентация.
+    # Части пакета кроме слайдов (мастер, макеты, фон, presentation.xml) записываются в close()
+    # теми же средствами python-pptx, что и в prs.save, поэтому файл получается таким же
+
+    def __init__(self, prs, out):
+        # out — путь или файлоподобный объект, как у prs.save
+        self.prs = prs
+        self.slide_count = 0
+        self._zip = zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED, strict_timestamps=False)
+
+    def flush(self):
+        # записывает все слайды, которые сейчас есть в prs, и убирает их из презентации
+        prs_part = self.prs.part
+        sld_id_lst = self.prs.slides._sldIdLst
+        for sld_id in list(sld_id_lst):
+            slide_part = prs_part.related_part(sld_id.rId)
+            self.slide_count += 1
+            partname = PackURI(f"/ppt/slides/slide{self.slide_count}.xml")
+            self._zip.writestr(partname.membername, slide_part.blob)
+            self._zip.writestr(partname.rels_uri.membername, slide_part.rels.xml)
+
+            prs_part.drop_rel(sld_id.rId)
+            sld_id_lst.remove(sld_id)
+
+    def close(self):
+        self.flush()
+
+        # слайды уже в архиве; в пакет добавляются пустые заглушки с теми же именами частей,
+        # чтобы python-pptx сам составил presentation.xml, его связи и [Content_Types].xml
+        prs_part = self.prs.part
+        package = prs_part.package
+        stubs = set()
+        for n in range(1, self.slide_count + 1):
+            stub = Part(PackURI(f"/ppt/slides/slide{n}.xml"), CT.PML_SLIDE, package, b"")
+            rId = prs_part.relate_to(stub, RT.SLIDE)
+            self.prs.slides._sldIdLst.add_sldId(rId)
+            stubs.add(stub)
+
+        parts = tuple(package.iter_parts())
+        try:
+            self._zip.writestr(
+                CONTENT_TYPES_URI.membername,
+                serialize_part_xml(_ContentTypesItem.xml_for(parts)),
+            )
+            self._zip.writestr(PACKAGE_URI.rels_uri.membername, package._rels.xml)
+            for part in parts:
+                if part in stubs:
+                    continue
+                self._zip.writestr(part.partname.membername, part.blob)
+                if part._rels:
+                    self._zip.writestr(part.partname.rels_uri.membername, part.rels.xml)
+        finally:
+            self._zip.close()
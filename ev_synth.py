@@ -0,0 +1,117 @@
+import io
+import random
+from datetime import datetime
+
+from openpyxl import Workbook
+from PIL import Image, ImageDraw
+
+from ev_pptx import AE_COL, CATEGORY_SHEET_INDEX, DEFAULT_HDR_G, DEFAULT_HDR_P, DEFAULT_HDR_W
+
+# синтетические книги в форме мастер-меню для замеров и нагрузочных тестов:
+# те же листы и ячейки, что читает ev_pptx, содержимое — из генератора с фиксированным seed
+
+MENU_SHEETS = range(3, 9)
+COST_SHEET_INDEX = 9
+HEADERS_SHEET_INDEX = 11
+
+FOOD_CATEGORIES = (
+    "Холодные закуски",
+    "Салаты",
+    "Горячие закуски",
+    "Супы",
+    "Горячее",
+    "Гарниры",
+    "Выпечка",
+    "Десерты",
+)
+DRINK_CATEGORIES = ("Безалкогольные напитки", "Соки", "Горячие напитки")
+DISH_WORDS = (
+    "с лососем", "с телятиной", "с грибами", "по-домашнему", "с соусом песто",
+    "на гриле", "с овощами", "из утки", "с сыром бри", "с ягодным соусом",
+)
+DISH_BASES = (
+    "Тарталетка", "Канапе", "Брускетта", "Рулет", "Салат", "Жюльен",
+    "Медальоны", "Филе", "Пирожок", "Тарт", "Морс", "Лимонад",
+)
+
+# время создания и изменения в свойствах книги — иначе одинаковые книги различались бы байтами
+FIXED_TIME = datetime(2024, 1, 1)
+
+
+def dish_name(rng: random.Random, sheet_index: int, number: int) -> str:
+    return f"{rng.choice(DISH_BASES)} {rng.choice(DISH_WORDS)} №{sheet_index}-{number}"
+
+
+def fill_menu_sheet(ws, rng: random.Random, sheet_index: int, dishes: int, categories):
+    # C1 — название листа, строка 2 — шапка как в шаблоне, дальше B–F: категория, блюдо, вес, порции, вес на персону
+    ws["C1"] = f"Меню {sheet_index - 2}"
+    ws.append([None, "Категория блюд", "Наименование", DEFAULT_HDR_W, DEFAULT_HDR_P, DEFAULT_HDR_G])
+    for number in range(dishes):
+        category = rng.choice(categories)
+        weight = rng.choice((30, 40, 50, 75, 100, 150, 200, 250, 300))
+        # часть строк шаблона не заказана: нулевые и пустые порции пропускаются при разборе
+        portions = rng.choice((0, None, 1, 2, 3, 5, 10, 15, 20, 30))
+        gpp = round(weight * (portions or 0) / 30, 3)
+        ws.append([None, category, dish_name(rng, sheet_index, number), weight, portions, gpp])
+        # в длинных листах шапка повторяется, как при копировании блоков в шаблоне
+        if number and number % 250 == 0:
+            ws.append([None, "Категория блюд", "Наименование", DEFAULT_HDR_W, DEFAULT_HDR_P, DEFAULT_HDR_G])
+
+
+def build_menu_workbook(dishes_per_sheet: int, seed: int = 0, skip_columns: bool = False, extra_sheets: int = 0) -> bytes:
+    # байты .xlsx; книга одинакова для одинаковых аргументов
+    rng = random.Random(seed)
+    categories = FOOD_CATEGORIES + DRINK_CATEGORIES
+
+    wb = Workbook()
+    wb.properties.created = FIXED_TIME
+    wb.properties.modified = FIXED_TIME
+    ws1 = wb.active
+    ws1.title = "Общая информация"
+    ws1["B3"] = f"Банкет на {rng.randint(20, 300)} персон"
+    for row in range(1, 7):
+        ws1[f"G{row}"] = f"День {row}"
+
+    for index in range(2, HEADERS_SHEET_INDEX + 1 + extra_sheets):
+        if index == COST_SHEET_INDEX:
+            ws = wb.create_sheet("Расчет стоимости")
+            ws["I1"] = 1 if skip_columns else None
+        else:
+            ws = wb.create_sheet(f"Лист{index}")
+
+        if index in MENU_SHEETS:
+            fill_menu_sheet(ws, rng, index, dishes_per_sheet, categories)
+        if index == CATEGORY_SHEET_INDEX:
+            # порядок категорий — AE3 и ниже; одну категорию не указываем, она уйдет в конец
+            order = list(categories[:-1])
+            rng.shuffle(order)
+            for offset, category in enumerate(order):
+                ws.cell(row=3 + offset, column=AE_COL, value=category)
+        if index == HEADERS_SHEET_INDEX:
+            ws["A1"] = DEFAULT_HDR_W
+            ws["B1"] = DEFAULT_HDR_P
+            ws["C1"] = DEFAULT_HDR_G
+            ws["A2"] = "на 30 персон"
+            ws["A4"] = "Итого выход еды на персону, грамм"
+            ws["A5"] = "Итого выход напитков на персону, мл"
+            for offset, category in enumerate(DRINK_CATEGORIES):
+                ws[f"A{8 + offset}"] = category
+
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def build_background(width: int, height: int, seed: int = 0, fmt: str = "PNG") -> bytes:
+    # фон с градиентом и пятнами: сжимается примерно как фотография, а не как заливка одним цветом
+    rng = random.Random(seed)
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randint(max(1, width // 80), max(2, width // 8))
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    out = io.BytesIO()
+    img.save(out, fmt)
+    return out.getvalue()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from ev_metrics import TELEGRAM_REQUESTS, TELEGRAM_RETRIES, TELEGRAM_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# после таймаута повторяем только запросы, повтор которых ничего не задвоит;
+# send_document просит повтор сам (rate_limit_args={"retry_timeouts": True}) — лишняя копия лучше потерянной
+IDEMPOTENT_METHODS = frozenset({"getMe", "getFile", "editMessageText", "deleteMessage", "setWebhook", "deleteWebhook"})
+
+# сколько чатов держим в памяти; простаивающие лимиты чатов вытесняются первыми
+CHAT_BUCKETS_MAX = 10000
+MAX_BACKOFF_SECONDS = 30
+
+
+class Throttled(Exception):
+    # необязательный запрос (rate_limit_args={"optional": True}) не отправлен: лимит чата или бота исчерпан
+    pass
+
+
+class TokenBucket:
+    # rate запросов в секунду, до burst подряд; block() — пауза после RetryAfter
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # ждущие запросы проходят по очереди, в порядке прихода
+        self.lock = asyncio.Lock()
+
+    def delay(self) -> float:
+        # сколько ждать до следующего запроса; 0 — можно сейчас
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self):
+        async with self.lock:
+            while (wait := self.delay()) > 0:
+                await asyncio.sleep(wait)
+            self.tokens -= 1
+
+    def try_acquire(self) -> bool:
+        if self.lock.locked() or self.delay() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        return not self.lock.locked() and self.delay() == 0 and self.tokens >= self.burst
+
+
+class FloodControlLimiter(BaseRateLimiter):
+    # все запросы бота к Bot API: сообщения в чаты укладываются в лимиты Telegram (на чат и на бота),
+    # RetryAfter и сетевые ошибки повторяются с паузой. Подключается через ApplicationBuilder.rate_limiter()
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int, max_retries: int):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = None
+        self._chats = OrderedDict()
+
+    async def initialize(self):
+        # секунда всплеска на бота: пачка ответов после простоя уходит сразу
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+        if len(self._chats) >= CHAT_BUCKETS_MAX:
+            for old_id in [key for key, old in self._chats.items() if old.idle()]:
+                del self._chats[old_id]
+                if len(self._chats) < CHAT_BUCKETS_MAX // 2:
+                    break
+        bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _wait_turn(self, chat: TokenBucket, optional: bool):
+        if optional:
+            # проверяем оба лимита до списания, чтобы не потратить место в чате впустую
+            if chat.lock.locked() or chat.delay() > 0 or not self._global.try_acquire():
+                raise Throttled()
+            chat.tokens -= 1
+            return
+        started = time.monotonic()
+        await chat.acquire()
+        await self._global.acquire()
+        TELEGRAM_WAIT_SECONDS.observe(time.monotonic() - started)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        options = rate_limit_args or {}
+        optional = bool(options.get("optional"))
+        chat_id = data.get("chat_id")
+        # лимиты Telegram касаются сообщений в чаты; getFile, getMe и т.п. идут без очереди
+        chat = self._chat_bucket(chat_id) if chat_id is not None else None
+
+        attempt = 0
+        while True:
+            if chat is not None:
+                try:
+                    await self._wait_turn(chat, optional)
+                except Throttled:
+                    TELEGRAM_REQUESTS.inc(method=endpoint, result="throttled")
+                    raise
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                # пауза касается всего чата, а без чата — всех запросов бота
+                (chat or self._global).block(e.retry_after)
+                reason, delay, error = "retry_after", e.retry_after, e
+            except BadRequest:
+                TELEGRAM_REQUESTS.inc(method=endpoint, result="failed")
+                raise
+            except TimedOut as e:
+                if endpoint not in IDEMPOTENT_METHODS and not options.get("retry_timeouts"):
+                    TELEGRAM_REQUESTS.inc(method=endpoint, result="failed")
+                    raise
+                reason, delay, error = "timeout", self._backoff(attempt), e
+            except NetworkError as e:
+                reason, delay, error = "network", self._backoff(attempt), e
+            except Exception:
+                TELEGRAM_REQUESTS.inc(method=endpoint, result="failed")
+                raise
+            else:
+                TELEGRAM_REQUESTS.inc(method=endpoint, result="ok")
+                return result
+
+            if optional and reason == "retry_after":
+                TELEGRAM_REQUESTS.inc(method=endpoint, result="throttled")
+                raise Throttled() from error
+            if optional or attempt >= self.max_retries:
+                TELEGRAM_REQUESTS.inc(method=endpoint, result="failed")
+                raise error
+            attempt += 1
+            TELEGRAM_RETRIES.inc(method=endpoint, reason=reason)
+            logger.warning("%s в чат %s: %s, повтор %s через %.1f с", endpoint, chat_id, error, attempt, delay)
+            # после RetryAfter пауза выдерживается лимитом чата (block), сверх нее не ждем
+            if reason != "retry_after" or chat is None:
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        # 1, 2, 4… секунд со случайным разбросом, чтобы повторы разных чатов не шли пачкой
+        return min(MAX_BACKOFF_SECONDS, 2 ** attempt) * random.uniform(0.5, 1.0)
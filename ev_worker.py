@@ -0,0 +1,229 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
+from pathlib import Path
+
+from config import (
+    RENDER_MODE,
+    PPTX_WRITER,
+    CACHE_DIR,
+    BG_DPI,
+    BG_JPEG_QUALITY,
+    MAX_IMAGE_MEGAPIXELS,
+    JOB_TIMEOUT_SECONDS,
+    JOB_MAX_MEMORY_MB,
+    RENDER_SPLIT_MIN_ROWS,
+    RESULT_CACHE_MAX_AGE_HOURS,
+    SHEET_CACHE_MAX_MB,
+    BG_CACHE_MAX_MB,
+)
+from ev_cache import BackgroundCache, SheetSlidesCache
+from ev_images import prepare_background
+from ev_limits import check_image_pixels, job_limits, limit_process_memory
+from ev_metrics import collect_phases, observe_phases, phase
+from ev_pptx import (
+    MenuModel,
+    build_menu_model,
+    build_workbook_context,
+    merge_sheet_slides,
+    render_book,
+    render_sheet_slides,
+    sheet_fingerprint,
+)
+
+BG_CACHE = BackgroundCache(
+    CACHE_DIR / "backgrounds",
+    max_bytes=BG_CACHE_MAX_MB * 1024 * 1024,
+    max_age_seconds=RESULT_CACHE_MAX_AGE_HOURS * 3600,
+)
+
+SHEET_CACHE = SheetSlidesCache(
+    CACHE_DIR / "sheets",
+    max_bytes=SHEET_CACHE_MAX_MB * 1024 * 1024,
+    max_age_seconds=RESULT_CACHE_MAX_AGE_HOURS * 3600,
+)
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+# все функции *_job выполняются в процессах пула
+
+def _prepare_bg(bg):
+    with phase("background"):
+        check_image_pixels(bg, MAX_IMAGE_MEGAPIXELS * 1_000_000)
+        return prepare_background(bg, BG_CACHE.cache_dir, BG_DPI, BG_JPEG_QUALITY)
+
+
+def extract_job(excel) -> MenuModel:
+    # разбор книги без сборки слайдов — запускается сразу, как только пришел Excel
+    with phase("load_workbook"):
+        ctx = build_workbook_context(excel)
+    with phase("collect_rows"):
+        return build_menu_model(ctx)
+
+
+def render_model_job(model: MenuModel, bg_path: Path, out_path: Path) -> str:
+    # возвращает название мероприятия из B3
+    bg_path = _prepare_bg(bg_path)
+    render_book(model, bg_path, out_path, RENDER_MODE, SHEET_CACHE, PPTX_WRITER)
+    return model.event_name
+
+
+def render_model_job_in_memory(model: MenuModel, bg_bytes: bytes):
+    # то же без файлов на диске: (название, байты .pptx)
+    bg = _prepare_bg(bg_bytes)
+    out = io.BytesIO()
+    render_book(model, bg, out, RENDER_MODE, SHEET_CACHE, PPTX_WRITER)
+    return model.event_name, out.getvalue()
+
+
+def render_sheet_job(model: MenuModel) -> list:
+    # model с единственным листом, чтобы не передавать в процесс все меню
+    sheet = model.sheets[0]
+    key = sheet_fingerprint(model, sheet, RENDER_MODE)
+    with phase("sheet", sheet=sheet.index, rows=len(sheet.rows)) as fields:
+        slides = SHEET_CACHE.get(key)
+        fields["cached"] = slides is not None
+        if slides is None:
+            slides = render_sheet_slides(model, sheet, RENDER_MODE)
+            SHEET_CACHE.put(key, slides)
+    return slides
+
+
+def merge_job(bg_path: Path, sheet_slides: list, out_path: Path) -> None:
+    bg_path = _prepare_bg(bg_path)
+    with phase("merge", sheets=len(sheet_slides)):
+        merge_sheet_slides(bg_path, sheet_slides, out_path, PPTX_WRITER)
+
+
+def merge_job_in_memory(bg_bytes: bytes, sheet_slides: list) -> bytes:
+    bg = _prepare_bg(bg_bytes)
+    out = io.BytesIO()
+    with phase("merge", sheets=len(sheet_slides)):
+        merge_sheet_slides(bg, sheet_slides, out, PPTX_WRITER)
+    return out.getvalue()
+
+
+def _init_worker(max_memory_bytes: int) -> None:
+    limit_process_memory(max_memory_bytes)
+
+
+def _run_limited(fn, *args):
+    # время и память одной задачи; превышение приходит в бот как LimitExceeded.
+    # Возвращает (результат, замеры этапов); при ошибке замеры едут в бот в атрибуте исключения
+    with collect_phases() as phases:
+        try:
+            with job_limits(JOB_TIMEOUT_SECONDS):
+                return fn(*args), phases
+        except Exception as e:
+            e.phases = phases
+            raise
+
+
+def _warm_up() -> None:
+    pass
+
+
+class RenderPool:
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = max(1, workers)
+        self.max_pending = self.workers + max(0, queue_size)
+        self.pending = 0
+        self._executor = None
+        self._slots = None
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        # spawn, чтобы не форкать процесс с уже запущенным event loop
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(JOB_MAX_MEMORY_MB * 1024 * 1024,),
+        )
+        self._slots = asyncio.Semaphore(self.workers)
+        # прогреваем процессы заранее, чтобы первый пользователь не ждал импорта pptx/openpyxl
+        for _ in range(self.workers):
+            self._executor.submit(_warm_up)
+
+    def shutdown(self) -> None:
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._slots = None
+
+    async def run(self, fn, *args, optional: bool = False):
+        # optional — вызов, без которого можно обойтись (фоновый разбор Excel): при заполненной очереди
+        # пула он отклоняется (RenderQueueFull). Задачи из очереди сборок не отклоняются никогда —
+        # их число и так ограничивает диспетчер, а отказ после ожидания в очереди терял бы презентацию
+        self.start()
+        if optional and self.pending >= self.max_pending:
+            raise RenderQueueFull()
+
+        self.pending += 1
+        executor = None
+        try:
+            while True:
+                slots = self._slots
+                async with slots:
+                    if slots is not self._slots:
+                        # пока ждали место, пул сломался и был остановлен: встаем в очередь нового пула,
+                        # иначе задача ушла бы в потоки самого бота без ограничений памяти
+                        self.start()
+                        continue
+                    executor = self._executor
+                    loop = asyncio.get_running_loop()
+                    result, phases = await loop.run_in_executor(executor, _run_limited, fn, *args)
+                    break
+        except BrokenProcessPool:
+            # процесс пула убит (например, OOM killer) — пересоздаем пул для следующих задач;
+            # останавливаем только сломанный пул, а не уже созданный вместо него
+            if self._executor is executor:
+                self.shutdown()
+            raise
+        except Exception as e:
+            observe_phases(getattr(e, "phases", ()))
+            raise
+        finally:
+            self.pending -= 1
+        observe_phases(phases)
+        return result
+
+
+def should_split(pool: RenderPool, model: MenuModel) -> bool:
+    # по листам имеет смысл собирать только большое меню и только пока в пуле есть свободные места:
+    # под нагрузкой процессы и так заняты чужими задачами
+    if pool.workers < 2 or len(model.sheets) < 2:
+        return False
+    if sum(len(sheet.rows) for sheet in model.sheets) < RENDER_SPLIT_MIN_ROWS:
+        return False
+    return pool.pending + len(model.sheets) + 1 <= pool.max_pending
+
+
+async def render_model(pool: RenderPool, model: MenuModel, bg, out_path: Path = None):
+    # результат как у render_model_job (out_path задан) или render_model_job_in_memory (out_path=None)
+    if not should_split(pool, model):
+        if out_path is None:
+            return await pool.run(render_model_job_in_memory, model, bg)
+        return await pool.run(render_model_job, model, bg, out_path)
+
+    # листы собираются одновременно в разных процессах, потом склеиваются по порядку
+    results = await asyncio.gather(
+        *(pool.run(render_sheet_job, replace(model, sheets=(sheet,))) for sheet in model.sheets),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    if out_path is None:
+        return model.event_name, await pool.run(merge_job_in_memory, bg, results)
+    await pool.run(merge_job, bg, results, out_path)
+    return model.event_name
@@ -0,0 +1,70 @@
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+
+def new_job_dir(work_dir: Path, chat_id: int) -> Path:
+    # у каждой задачи своя папка, параллельные задачи не трогают файлы друг друга
+    return work_dir / f"{chat_id}_{uuid.uuid4().hex[:12]}"
+
+
+def remove_dir(path: Path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def dir_size(path: Path) -> int:
+    total = 0
+    for item in path.rglob("*"):
+        try:
+            if item.is_file():
+                total += item.stat().st_size
+        except OSError:
+            pass
+    return total
+
+
+def sweep_work_dir(work_dir: Path, max_age_seconds: int, max_bytes: int, active=(), keep=()) -> int:
+    # удаляет просроченные папки задач; если места все равно больше бюджета —
+    # самые старые из неактивных. Активные папки удаляются только по возрасту,
+    # папки из keep (задачи в очереди сборок) — никогда: их файлы ждут сборки даже после долгого простоя
+    if not work_dir.exists():
+        return 0
+
+    now = time.time()
+    keep = {Path(p) for p in keep}
+    active = {Path(p) for p in active}
+    removed = 0
+    entries = []
+
+    for item in work_dir.iterdir():
+        if item in keep:
+            continue
+        try:
+            mtime = item.stat().st_mtime
+        except OSError:
+            continue
+
+        if now - mtime > max_age_seconds:
+            if item.is_dir():
+                remove_dir(item)
+            else:
+                item.unlink(missing_ok=True)
+            removed += 1
+            continue
+
+        if item.is_dir():
+            entries.append((mtime, dir_size(item), item))
+
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, item in entries:
+        if total <= max_bytes:
+            break
+        if item in active:
+            continue
+        remove_dir(item)
+        removed += 1
+        total -= size
+
+    return removed
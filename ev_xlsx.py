@@ -0,0 +1,107 @@
+import io
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+from ev_limits import LIMIT_SHEET_ROWS, LIMIT_WORKBOOK_SIZE, LimitExceeded
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+WORKSHEET_REL_TYPE = NS_REL + "/worksheet"
+
+MIN_SHEETS = 11
+MENU_SHEETS = range(3, 9)
+
+# <dimension> стоит в начале листа, читать весь XML не нужно
+DIMENSION_PROBE_BYTES = 4096
+DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension\s+ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"')
+
+
+class WorkbookRejected(Exception):
+    # книга не подходит; текст исключения можно показать пользователю
+    pass
+
+
+def open_zip(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        return zipfile.ZipFile(source)
+    except (zipfile.BadZipFile, OSError):
+        raise WorkbookRejected(
+            "Не получилось открыть файл как книгу Excel. "
+            "Сохраните мастер-меню в формате .xlsx и пришлите ещё раз."
+        )
+
+
+def list_worksheets(zf: zipfile.ZipFile):
+    # [(имя листа, путь к XML в архиве)] в порядке книги — как wb.worksheets в openpyxl
+    try:
+        workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+        rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    except (KeyError, ET.ParseError):
+        raise WorkbookRejected("Файл повреждён или не является книгой Excel (.xlsx).")
+
+    targets = {}
+    for rel in rels.iter(f"{{{NS_PKG_REL}}}Relationship"):
+        if rel.get("Type") != WORKSHEET_REL_TYPE:
+            continue
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            path = target.lstrip("/")
+        else:
+            path = posixpath.normpath(posixpath.join("xl", target))
+        targets[rel.get("Id")] = path
+
+    sheets = []
+    for sheet in workbook.iter(f"{{{NS_MAIN}}}sheet"):
+        path = targets.get(sheet.get(f"{{{NS_REL}}}id"))
+        if path:
+            sheets.append((sheet.get("name", ""), path))
+    return sheets
+
+
+def read_dimension_rows(zf: zipfile.ZipFile, path: str):
+    try:
+        with zf.open(path) as f:
+            head = f.read(DIMENSION_PROBE_BYTES)
+    except KeyError:
+        raise WorkbookRejected("Файл повреждён: в книге не хватает листов.")
+    m = DIMENSION_RE.search(head)
+    if not m:
+        return None
+    return int(m.group(4) or m.group(2))
+
+
+def check_workbook_manifest(source, max_sheet_rows: int, max_uncompressed_bytes: int):
+    # быстрая проверка по оглавлению zip: без разбора ячеек, за миллисекунды.
+    # zipfile не распаковывает больше объявленного file_size, поэтому сумма по оглавлению —
+    # честная верхняя граница того, что прочитает openpyxl
+    with open_zip(source) as zf:
+        uncompressed = sum(info.file_size for info in zf.infolist())
+        if uncompressed > max_uncompressed_bytes:
+            raise LimitExceeded(
+                LIMIT_WORKBOOK_SIZE,
+                f"Книга слишком большая: {uncompressed // (1024 * 1024)} МБ после распаковки "
+                f"(максимум {max_uncompressed_bytes // (1024 * 1024)} МБ)."
+            )
+
+        sheets = list_worksheets(zf)
+        if len(sheets) < MIN_SHEETS:
+            raise WorkbookRejected(
+                f"В книге {len(sheets)} лист(ов), а нужен минимум {MIN_SHEETS} "
+                "(служебный лист с заголовками). Проверьте, что это файл мастер-меню."
+            )
+
+        for idx in MENU_SHEETS:
+            name, path = sheets[idx - 1]
+            rows = read_dimension_rows(zf, path)
+            if rows is not None and rows > max_sheet_rows:
+                raise LimitExceeded(
+                    LIMIT_SHEET_ROWS,
+                    f"Лист «{name}» слишком большой: {rows} строк (максимум {max_sheet_rows})."
+                )
+
+        return sheets